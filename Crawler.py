@@ -0,0 +1,744 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import multiprocessing
+import itertools
+from lxml import etree
+import os
+import os.path
+import sys
+from fnmatch import fnmatch
+import subprocess
+import string
+import shutil
+import threading
+
+from Derivatives import *
+from Discovery import *
+from Manifest import *
+from PageDocument import *
+from WordCoordinates import *
+from Stats import *
+
+# get the logger
+log = logging.getLogger(__name__)
+
+# the namespace of the OmniPage OCR data
+OMNIPAGE_NS = 'http://www.scansoft.com/omnipage/xml/ssdoc-schema3.xsd'
+
+# the compiled XSL transforms: path -> (mtime, transform)
+transforms_cache = {}
+
+def get_transform(path):
+    """Return the compiled XSL transform at path
+
+    Transforms are compiled the first time they're asked for and reused until
+    the file's mtime changes.
+    """
+    mtime = os.stat(path).st_mtime
+    cached = transforms_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    log.debug("Compiling XSL transform: %s" % path)
+    xsl = etree.parse(path)
+    xsl.xinclude()
+    xsl = etree.XSLT(xsl)
+    transforms_cache[path] = (mtime, xsl)
+    return xsl
+
+class Crawler:
+    def __init__(self, input_folder, n, output_folder, transforms, url_base, workers=1, engine='pillow',
+            manifest=None, sink=None, write_stubs=True, words=None, stats=None, items_from=None,
+            changes=None, prune=False, tiles=False, shard=None):
+        self.input_folder = input_folder
+        self.items_from = items_from
+        self.shard = shard
+        if n is not None:
+            self.stop_after = int(n)
+        else:
+            self.stop_after = n
+        self.output_folder = output_folder
+        self.transforms = transforms
+        self.url_base = url_base
+        self.workers = workers
+
+        # the record of what was processed in earlier runs (if we're keeping one)
+        self.manifest = manifest
+        self.disappeared = []
+
+        # where the page documents go as they're created (eg. Index.add) and
+        #  whether they're also written out as solr stub files
+        self.sink = sink
+        self.write_stubs = write_stubs
+
+        # or where all of an item's page documents go in one go (eg. Index.stream)
+        self.item_sink = None
+        self.documents = []
+
+        # the output files created, rewritten or removed in the run are listed
+        #  (relative to the output folder) in the changes file if there is one
+        self.changes = changes
+        self.changed_files = []
+
+        # remove the output of the items which have disappeared from the input
+        self.prune = prune
+
+        # the items handed to the workers and not yet processed() are limited
+        #  by these slots (only while there's a pool)
+        self.slots = None
+
+        # the times and counters for the run
+        self.stats = stats if stats is not None else Stats()
+
+        # how the word coordinates are written
+        self.words = words if words is not None else WordCoordinates()
+
+        # create the jpegs in process unless we've been asked to use convert
+        self.derivatives = None
+        if engine == 'pillow':
+            self.derivatives = Derivatives()
+            if not self.derivatives.available():
+                log.warn("Pillow isn't installed; using convert to create the jpegs")
+                self.derivatives = None
+
+        # the deep zoom tiles of each page are only made with Pillow
+        self.tiles = tiles
+        if tiles and self.derivatives is None:
+            log.warn("The page tiles can only be created with Pillow; not creating them")
+            self.tiles = False
+
+    def run(self):
+        """Process every item found in the input folder
+
+        Items are handed to a pool of worker processes when more than one worker
+        has been requested; otherwise they're processed one after another.
+        """
+        if self.changes is not None:
+            self.changes_file = open(self.changes, 'a')
+
+        items = self.find_items()
+        if self.manifest is not None:
+            # the whole input is walked (so we know what's disappeared) before
+            #  any processing starts
+            items = [ d for d in items if self.changed(d) ]
+            log.info("%s items are new or have changed since the last run" % len(items))
+
+        if self.stop_after is not None:
+            items = itertools.islice(items, self.stop_after)
+
+        if self.workers > 1:
+            log.info("Processing the items with %s workers" % self.workers)
+            pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self,))
+
+            # the pool takes items as fast as we give them; waiting for a slot
+            #  keeps the queued items and their results from piling up when
+            #  the documents go out slower than they're made
+            self.slots = threading.Semaphore(self.workers * 2)
+            try:
+                for datafiles, result in pool.imap(process_item, self.throttled(items)):
+                    self.processed(datafiles, result)
+                pool.close()
+            except:
+                # let the pool's task thread out of throttled() so it can stop
+                slots, self.slots = self.slots, None
+                slots.release()
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                self.slots = None
+        else:
+            for datafiles in items:
+                self.processed(datafiles, self.process_item(datafiles))
+
+        # only a full walk of the input can tell us what's disappeared
+        if self.manifest is not None and self.items_from is None:
+            self.disappeared = self.manifest.disappeared()
+            if self.shard is not None:
+                # the items of the other shards weren't looked for
+                self.disappeared = [ (dirpath, item) for dirpath, item in self.disappeared
+                    if in_shard(*(item.split('-', 1) + list(self.shard))) ]
+            for dirpath, item in self.disappeared:
+                log.warn("Item has disappeared from the input: %s: %s" % (item, dirpath))
+                if self.prune:
+                    self.remove_output(item)
+
+        if self.changes is not None:
+            self.changes_file.close()
+
+    def throttled(self, items):
+        """Yield the items as slots are freed by processed()"""
+        slots = self.slots
+        for datafiles in items:
+            slots.acquire()
+            if self.slots is None:
+                return
+            yield datafiles
+
+    def changed(self, datafiles):
+        """Have the item's inputs changed since it was last processed?"""
+        with self.stats.timer('manifest'):
+            datafiles['signature'] = self.manifest.signature(self.item_inputs(datafiles), self.output_options())
+            group = "%s-%s" % (datafiles['bibrecid'], datafiles['item'])
+            output_folder = os.path.join(self.output_folder, datafiles['bibrecid'], datafiles['item'])
+            if self.manifest.changed(datafiles['dirpath'], group, datafiles['signature']) or not os.path.exists(output_folder):
+                return True
+        log.debug("Unchanged; skipping: %s" % group)
+        self.stats.incr('items_unchanged')
+        return False
+
+    def processed(self, datafiles, result):
+        """Record the outcome of processing an item
+
+        This always runs in the main process, whether or not there are workers.
+        """
+        # the times and counters from the worker process
+        if 'stats' in result:
+            self.stats.merge(result['stats'])
+
+        # pass the page documents on to the indexer
+        if self.sink is not None:
+            for name, doc in result['documents']:
+                self.sink(doc, name)
+
+        # an item solr didn't take isn't recorded so the next run does it again
+        sent = True
+        if self.item_sink is not None and result['documents']:
+            sent = self.item_sink(lambda documents=result['documents']: stub_documents(documents),
+                "%s-%s" % (datafiles['bibrecid'], datafiles['item']))
+
+        if self.changes is not None:
+            self.record_changes(result['changes'])
+
+        if self.manifest is not None and result['processed'] and sent is not False:
+            group = "%s-%s" % (datafiles['bibrecid'], datafiles['item'])
+            self.manifest.record(datafiles['dirpath'], group, datafiles['signature'])
+
+        # the next item can go to the workers
+        if self.slots is not None:
+            self.slots.release()
+
+    def changed_file(self, path, removed=False):
+        """Note an output file that has been (re)written or removed"""
+        if self.changes is not None:
+            self.changed_files.append(('-' if removed else '+', path))
+
+    def record_changes(self, changes):
+        """Add the changed output files to the changes file"""
+        for change, path in changes:
+            self.changes_file.write("%s %s\n" % (change, os.path.relpath(path, self.output_folder)))
+        self.changes_file.flush()
+
+    def remove_output(self, group):
+        """Remove the output folder of an item"""
+        bibrecid, item = group.split('-', 1)
+        output_folder = os.path.join(self.output_folder, bibrecid, item)
+        if not os.path.exists(output_folder):
+            return
+
+        log.info("Removing the output of %s: %s" % (group, output_folder))
+        changes = []
+        for dirpath, dirnames, filenames in os.walk(output_folder):
+            changes += [ ('-', os.path.join(dirpath, f)) for f in filenames ]
+        shutil.rmtree(output_folder)
+        if not os.listdir(os.path.dirname(output_folder)):
+            os.rmdir(os.path.dirname(output_folder))
+        self.stats.incr('items_removed')
+        if self.changes is not None:
+            self.record_changes(changes)
+
+    def item_inputs(self, datafiles):
+        """All of the input files that go into making an item's output"""
+        inputs = list(datafiles['metadata_files'])
+        inputs.append(os.path.join(self.transforms, 'udc-item.xsl'))
+        for path in datafiles['image_dirs'] + [ datafiles['ocr_dir'] ]:
+            if path is not None:
+                inputs += [ os.path.join(path, f) for f in os.listdir(path) ]
+        return inputs
+
+    def output_options(self):
+        """The options that change an item's output, so that changing one redoes the items
+
+        Only those that aren't the defaults are listed; a manifest written with
+        the defaults stays valid.
+        """
+        options = []
+        if self.derivatives is None:
+            options.append('engine=convert')
+        if self.tiles:
+            options.append('tiles')
+        if self.words.format != 'dict':
+            options.append("words-format=%s" % self.words.format)
+        if self.words.compress:
+            options.append('words-gzip')
+        return ' '.join(options)
+
+    def find_items(self):
+        """Find the items in the input folder (or items file) yielding the data files of each"""
+        count = 0
+        items = Discovery(self.input_folder, self.items_from, self.shard).items()
+        while True:
+            with self.stats.timer('discover'):
+                try:
+                    datafiles = next(items)
+                except StopIteration:
+                    break
+
+            count += 1
+            self.stats.incr('items_found')
+            datafiles['count'] = count
+            yield datafiles
+
+    def process_item(self, datafiles):
+        """Create the derivatives and solr records for an item
+
+        Returns a dict with 'processed' (True if the item was processed) and, if
+        there's a sink for them, the page 'documents' as (name, document) tuples
+        (the document is None when it's streamed from the stub written) and, if there's a changes file, the output files written as 'changes'.
+
+        @params:
+        datafiles: the description of the item as produced by find_items
+        """
+        result = { 'processed': False, 'documents': [], 'changes': [] }
+        self.documents = result['documents']
+        self.changed_files = result['changes']
+
+        bibrecid = datafiles['bibrecid']
+        item = datafiles['item']
+        log.info("Processing: %s: %s-%s" % (datafiles['count'], bibrecid, item))
+        log.debug(datafiles);
+
+        self.stats.incr('items')
+
+        # setup 
+        output_folder = self.setup(bibrecid, item)
+
+        # get the metadata
+        with self.stats.timer('metadata'):
+            metadata = self.get_metadata(datafiles['metadata_files'], bibrecid, item)
+        if metadata == None:
+            log.error("Metadata file invalid. Not continuing.")
+            self.stats.incr('items_failed')
+            return result
+
+        # process any images
+        found_images = False;
+        for path in datafiles['image_dirs']:
+            if os.path.exists(path):
+                found_images = True;
+                with self.stats.timer('images'):
+                    self.process_images(path, output_folder)
+
+                # create a solr record for each image found
+                url_base = os.path.join(self.url_base, bibrecid, item)
+                with self.stats.timer('pages'):
+                    self.create_page_documents(output_folder, metadata, url_base,
+                        datafiles['ocr_dir'] or os.path.join(datafiles['dirpath'], OCR_FOLDER))
+                break
+        
+        if not found_images:
+            log.error("No images found! %s, %s" % (bibrecid, item))
+            self.stats.incr('items_failed')
+
+        log.info("")
+        result['processed'] = found_images
+        return result
+
+    def setup(self, bibrecid, item):
+        """Setup the required output folder structure"""
+        log.info('Setting up the required folder structure')
+        output_folder = os.path.join(self.output_folder, bibrecid, item) 
+        if not os.path.exists(output_folder):
+            log.debug("Creating: %s" % output_folder)
+            os.makedirs(output_folder)
+ 
+        solr = os.path.join(output_folder, 'solr')
+        if self.write_stubs and not os.path.exists(solr):
+            log.debug("Creating: %s" % solr)
+            os.makedirs(solr)
+
+        words = os.path.join(output_folder, 'words')
+        if not os.path.exists(words):
+            log.debug("Creating: %s" % words)
+            os.makedirs(words)
+
+        return output_folder
+
+    def get_metadata(self, metadata_files, bibrecid, item):
+        """Extract the item metadata and return it as an lxml document"""
+        log.debug('Extracting the item metadata')
+
+        for m in metadata_files:
+            if fnmatch(m, '*-item.xml'):
+                transform = os.path.join(self.transforms, 'udc-item.xsl')
+                self.stats.incr('bytes_read', os.path.getsize(m))
+                d = self.process_document(m, transform)
+                if d == None:
+                    log.error("Couldn't get any metadata from: %s" % m)
+                    return
+                d = self.add_field(d, 'bibrecid', bibrecid)
+                d = self.add_field(d, 'item', item)
+                d = self.add_field(d, 'group', "%s-%s" % (bibrecid, item))
+
+            #elif fnmatch(m, '*-cat.xml'):
+            #    transform = os.path.join(self.transforms, 'udc-cat.xsl')
+            #    e = self.process_document(m, transform)
+
+        log.debug("Metadata\n%s" % etree.tostring(d, pretty_print=True))
+        return d 
+
+    def process_document(self, d, transform):
+        try:
+            log.debug("Reading in XSL transform to process metadata_file: %s" % transform)
+            xsl = get_transform(transform)
+        except (IOError, OSError):
+            log.error("No such transform: %s" % transform)
+            return
+        except etree.XSLTParseError:
+            log.error("Check the stylesheet; I can't parse it! %s" % transform)
+            return
+
+        # read in the metadata file 
+        log.debug("Reading in the metadata file: %s" % d)
+        try:
+            tree = etree.parse(d)
+        except etree.XMLSyntaxError:
+            log.error("Invalid metadata file: %s" % d)
+            return
+
+        # transform it!
+        log.debug("Transforming the document")
+        d = xsl(tree)
+        return d
+
+    def add_field(self, doc, field_name, field_value):
+        tmp = doc.xpath('/add/doc')[0]
+
+        # add the record and item metadata 
+        b = etree.Element('field', name=field_name)
+        b.text = field_value
+        tmp.append(b)
+
+        add = etree.Element('add')
+        add.append(tmp)
+        return add
+
+    def process_images(self, path, output_folder):
+        log.info('Processing the image set')
+        output_folder = os.path.join(output_folder, 'jpg')
+        if not os.path.exists(output_folder):
+            log.debug("Creating: %s" % output_folder)
+            os.makedirs(output_folder)
+
+        large_images = os.path.join(output_folder, 'large')
+        if not os.path.exists(large_images):
+            log.debug("Creating: %s" % large_images)
+            os.makedirs(large_images)
+
+        thumb_images = os.path.join(output_folder, 'thumb')
+        if not os.path.exists(thumb_images):
+            log.debug("Creating: %s" % thumb_images)
+            os.makedirs(thumb_images)
+
+        tiles = os.path.join(output_folder, 'tiles')
+        if self.tiles and not os.path.exists(tiles):
+            log.debug("Creating: %s" % tiles)
+            os.makedirs(tiles)
+
+        for f in os.listdir(path):
+            # have we already converted this file - skip it if we have
+            file_basename = os.path.basename(f).split('.')[0]
+
+            # file fully qualified path
+            file_full_path = os.path.join(path, f)
+
+            # only handle image files in the specified format 
+            extension = os.path.splitext(f)[1]
+            if extension in [ '.tif', '.jp2' ]:
+
+                large_file = os.path.join(large_images, "%s.jpg" % file_basename)
+                thumb_file = os.path.join(thumb_images, "%s.jpg" % file_basename)
+                 
+                make_large = not os.path.exists(large_file) or os.stat(large_file).st_size == 0
+                make_thumb = make_large or not os.path.exists(thumb_file) or os.stat(thumb_file).st_size == 0
+                tiles_file = os.path.join(tiles, "%s.dzi" % file_basename)
+                make_tiles = self.tiles and not os.path.exists(tiles_file)
+                if not make_thumb and not make_tiles:
+                    self.stats.incr('images_skipped')
+                    continue
+
+                self.stats.incr('images_converted')
+                if make_large or make_tiles:
+                    self.stats.incr('bytes_read', os.path.getsize(file_full_path))
+
+                # decode the source once and create all of the images from it
+                if self.derivatives is not None:
+                    log.debug("Creating derivatives for %s" % file_full_path)
+                    if self.derivatives.create(file_full_path, large_file, thumb_file, make_large, make_thumb,
+                            tiles_file if make_tiles else None):
+                        for written in self.derivatives.written:
+                            self.changed_file(written)
+                        continue
+                    log.info("Falling back to convert for %s" % file_full_path)
+
+                if not make_thumb:
+                    self.stats.incr('images_failed')
+                    continue
+
+                # if we don't have a large image - create it
+                if make_large:
+                    log.debug("Creating jpeg for %s" % file_full_path)
+                    cmd = "convert %s -resample 200 -strip -resize '3000x3000>' -compress JPEG -quality 30 -depth 8 -unsharp '1.5x1+0.7+0.02' %s" % (file_full_path, large_file)
+                    try:
+                        p = subprocess.check_call(cmd, stderr=subprocess.PIPE, shell=True)
+                        self.changed_file(large_file)
+                    except:
+                        self.stats.incr('images_failed')
+                        log.error("Error creating large jpeg")
+                        log.error("%s" % cmd)
+
+                # if we don't have a thumbnail - create it
+                log.debug("Creating thumbnail for %s" % file_full_path)
+                cmd = "convert %s -thumbnail 100x200 -strip -depth 8 %s" % (large_file, thumb_file)
+                try:
+                    p = subprocess.check_call(cmd, stderr=subprocess.PIPE, shell=True)
+                    self.changed_file(thumb_file)
+                except:
+                    self.stats.incr('images_failed')
+                    log.error("Error creating thumbnail")
+                    log.error("%s" % cmd)
+
+    def create_page_documents(self, output_folder, metadata, url_base, ocr_data):
+        """Create the solr document (with the OCR text) and word coordinates for each page
+
+        @params:
+        output_folder: the item's output folder
+        metadata: the item metadata
+        url_base: the URL of the item's output folder
+        ocr_data: the folder containing the item's OCR data
+        """
+        log.info('Creating the page documents')
+        images = os.path.join(output_folder, 'jpg', 'large')
+        solr = os.path.join(output_folder, 'solr')
+
+        files = os.listdir(images)
+        total_pages = str(len(files))
+        builder = PageDocument(metadata)
+        word_index = WordIndex()
+        words_index = os.path.join(url_base, 'words', 'index.json')
+
+        for f in files:
+            basename = os.path.splitext(os.path.basename(f))[0]
+
+            rid = os.path.join(url_base, 'solr', basename)
+            large_image = os.path.join(url_base, 'jpg/large', "%s.jpg" % basename)
+            thumb_image = os.path.join(url_base, 'jpg/thumb', "%s.jpg" % basename)
+            tiles = os.path.join(url_base, 'jpg/tiles', "%s.dzi" % basename)
+            words = os.path.join(url_base, 'words', self.words.filename(basename))
+
+            fields = [
+                ('id', "%s.xml" % rid),
+                ('page', basename.split('-')[2]),
+                ('large_image', large_image),
+                ('thumb_image', thumb_image),
+                ('total_pages', total_pages),
+                ('words', words),
+            ]
+
+            if self.tiles and os.path.exists(os.path.join(output_folder, 'jpg', 'tiles', "%s.dzi" % basename)):
+                fields.append(('tiles', tiles))
+
+            # add the OCR text and write out the word coords json file
+            ocr_data_file = os.path.join(ocr_data, "%s.xml" % basename)
+            if os.path.exists(ocr_data_file):
+                self.stats.incr('bytes_read', os.path.getsize(ocr_data_file))
+                with self.stats.timer('ocr'):
+                    text, words = self.get_ocr_data(ocr_data_file)
+                fields.append(('text', text))
+                if words is not None:
+                    fields.append(('words_index', words_index))
+
+                words_file = os.path.join(output_folder, 'words', self.words.filename(basename))
+                self.words.write(words_file, words)
+                self.changed_file(words_file)
+                word_index.add(basename.split('-')[2], words)
+
+            doc = builder.build(fields)
+            self.stats.incr('pages')
+            fh = os.path.join(solr, "%s.xml" % basename)
+            if self.sink is not None:
+                self.documents.append((fh, doc))
+            elif self.item_sink is not None:
+                # a streamed item is read back from its stubs as it's sent
+                self.documents.append((fh, None if self.write_stubs else doc))
+
+            if self.write_stubs:
+                log.debug("Writing metatdata to: %s " % fh)
+                f = open(fh, 'w')
+                f.write(doc)
+                f.close()
+                self.changed_file(fh)
+
+        # and one index of where the words are on all of the item's pages
+        if word_index.pages:
+            for written in word_index.write(os.path.join(output_folder, 'words')):
+                self.changed_file(written)
+        else:
+            for removed in word_index.remove(os.path.join(output_folder, 'words')):
+                self.changed_file(removed, removed=True)
+
+    def get_ocr_data(self, ocr_data_file):
+        """Extract the page text and the word coordinates from an OmniPage file
+
+        The file is read in a single streaming pass and elements are discarded as
+        soon as they've been used so memory use doesn't grow with the page size.
+
+        Returns a tuple of (text, words) where text is the whitespace normalised
+        text of the first page (None if the page has no body/section) and words
+        is the page dimensions and word coordinates:
+
+          { 'page': { 'width', 'height' }, 'words': { word: [ { 'left', 'right', 'top', 'bottom' } ] } }
+
+        Either is None if the file can't be read.
+        """
+        page_tag = '{%s}page' % OMNIPAGE_NS
+        body_tag = '{%s}body' % OMNIPAGE_NS
+        section_tag = '{%s}section' % OMNIPAGE_NS
+        dimensions_tag = '{%s}theoreticalPage' % OMNIPAGE_NS
+        word_tag = '{%s}wd' % OMNIPAGE_NS
+
+        text = None
+        page_dimensions = None
+        words = {}
+
+        # the text of the first page is assembled as its elements close: each open
+        #  element has a list of the text of its (closed) children
+        collecting = False
+        found_page = False
+        found_section = False
+        stack = []
+
+        try:
+            for event, element in etree.iterparse(ocr_data_file, events=('start', 'end')):
+                if event == 'start':
+                    if element.tag == dimensions_tag:
+                        page_dimensions = { 'width': element.get('width'), 'height': element.get('height') }
+
+                    if collecting:
+                        if element.tag == section_tag and [ e.tag for e, c in stack[-2:] ] == [ page_tag, body_tag ]:
+                            found_section = True
+                        stack.append((element, []))
+                    elif not found_page and element.tag == page_tag:
+                        collecting = found_page = True
+                        stack.append((element, []))
+                    continue
+
+                if element.tag == word_tag:
+                    self.add_ocr_word(words, element)
+
+                if not collecting:
+                    # we're done with this element and anything before it
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                    continue
+
+                # the children have closed so their tails are known now
+                e, children = stack.pop()
+                content = [ element.text or '' ]
+                for child, child_content in children:
+                    content.append(child_content)
+                    content.append(child.tail or '')
+                content = ''.join(content)
+                del element[:]
+
+                if stack:
+                    stack[-1][1].append((element, content))
+                else:
+                    collecting = False
+                    if found_section:
+                        text = " ".join(content.split())
+        except etree.XMLSyntaxError:
+            log.error("Couldn't parse: %s" % ocr_data_file)
+            return text, None
+
+        if page_dimensions is None:
+            log.error("No page dimensions in: %s" % ocr_data_file)
+            return text, None
+
+        return text, { 'page': page_dimensions, 'words': words }
+
+    def add_ocr_word(self, words, element):
+        """Add the coordinates of an OCR word element to the words dictionary"""
+        coords = { 'left': element.get('l'), 'right': element.get('r'), 'top': element.get('t'), 'bottom': element.get('b') }
+
+        # nb. the existing coordinates are looked up using the word as
+        #  found but are stored with the trailing punctuation stripped
+        word_list = words.get(element.text)
+        try:
+            w = element.text.rstrip(string.punctuation)
+            if word_list is None:
+                words[w] = [coords]
+            else:
+                word_list.append(coords)
+                words[w] = word_list
+        except AttributeError:
+            pass
+
+# the crawler used by the worker processes of the pool
+worker_crawler = None
+
+def init_worker(crawler):
+    """Setup a pool worker process"""
+    global worker_crawler
+    worker_crawler = crawler
+
+    # the times and counters collected before the fork belong to the main
+    #  process; the worker only hands back its own
+    crawler.stats.pop()
+
+def stub_documents(documents):
+    """Yield (name, document) tuples, reading the documents that weren't kept from their stubs"""
+    for name, doc in documents:
+        if doc is None:
+            try:
+                fh = open(name)
+                doc = fh.read()
+                fh.close()
+            except IOError, e:
+                log.error("Couldn't read %s: %s" % (name, e))
+                continue
+        yield name, doc
+
+def process_item(datafiles):
+    """Process an item in a pool worker process"""
+    result = worker_crawler.process_item(datafiles)
+
+    # hand this item's times and counters back to the main process
+    result['stats'] = worker_crawler.stats.pop()
+    worker_crawler.stats.dump_profiles(os.getpid())
+    return datafiles, result
@@ -0,0 +1,292 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import math
+import os
+import os.path
+import struct
+
+# Pillow is optional - without it we fall back to ImageMagick's convert
+try:
+    from PIL import Image, ImageFilter
+except ImportError:
+    Image = None
+
+# the errors that mean an image couldn't be decoded (and convert should be tried)
+DECODE_ERRORS = (IOError, ValueError, SyntaxError, MemoryError)
+if Image is not None:
+    # the masters are our own scans, not untrusted uploads, and a 600dpi
+    #  newspaper page is well over Pillow's decompression bomb limit
+    Image.MAX_IMAGE_PIXELS = None
+    if hasattr(Image, 'DecompressionBombError'):
+        DECODE_ERRORS += (Image.DecompressionBombError,)
+
+# get the logger
+log = logging.getLogger(__name__)
+
+class Derivatives:
+    """Create the web derivatives of a page image in process
+
+    The settings mirror the convert commands used by the crawler:
+
+      convert (source) -resample 200 -strip -resize '3000x3000>' -compress JPEG
+          -quality 30 -depth 8 -unsharp '1.5x1+0.7+0.02' (large)
+      convert (large) -thumbnail 100x200 -strip -depth 8 (thumb)
+
+    except that the source is only decoded once and the thumbnail is made from
+    the large image in memory rather than from the jpeg on disk.
+
+    A Deep Zoom tile pyramid of the page at the full resampled resolution can
+    also be made from the same decoded source.
+
+    Sources are decoded at the lowest resolution they hold that is still at least
+    the size needed: a JPEG2000 resolution level or a reduced resolution page of
+    a (pyramidal) TIFF. Anything else is decoded in full.
+    """
+    def __init__(self, resolution=200, size=(3000, 3000), quality=30, thumb_size=(100, 200),
+            unsharp=(1, 70, 5), tile_size=256, tile_overlap=1):
+        self.resolution = resolution
+        self.size = size
+        self.quality = quality
+        self.thumb_size = thumb_size
+        self.unsharp = unsharp
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+        # the files written by the last call to create
+        self.written = []
+
+    def available(self):
+        """Is Pillow installed?"""
+        return Image is not None
+
+    def create(self, source, large_file, thumb_file, make_large=True, make_thumb=True, tiles_file=None):
+        """Create the large jpeg, the thumbnail and / or the tiles for a source image
+
+        Returns True if the requested derivatives were written; the files written
+        are listed in self.written.
+
+        @params:
+        source: the TIFF or JPEG2000 image
+        large_file: the large jpeg
+        thumb_file: the thumbnail jpeg
+        make_large: create the large jpeg; otherwise the thumbnail is made from the existing one
+        make_thumb: create the thumbnail
+        tiles_file: create a tile pyramid described by this .dzi file
+        """
+        self.written = []
+        try:
+            img = None
+            if tiles_file is not None:
+                # the tiles are cut at the full resampled resolution and the
+                #  large jpeg is then made from that
+                img = self.resample(self.open(source, self.resampled_size))
+                self.written += self.tiles(img, tiles_file)
+
+            if make_large:
+                large = self.large(img if img is not None else self.open(source, self.large_size))
+                large.save(large_file, 'JPEG', quality=self.quality, dpi=(self.resolution, self.resolution))
+                self.written.append(large_file)
+            elif make_thumb:
+                # all we need is the thumbnail and we already have the
+                #  large jpeg - so there's no need to decode the master
+                large = Image.open(large_file)
+                large.draft(large.mode, self.thumb_size)
+                large = self.depth8(large)
+
+            if make_thumb:
+                self.thumbnail(large).save(thumb_file, 'JPEG', quality=self.quality)
+                self.written.append(thumb_file)
+        except DECODE_ERRORS, e:
+            log.error("Couldn't create the derivatives of %s: %s" % (source, e))
+            return False
+        return True
+
+    def open(self, source, target):
+        """Open a source image at the lowest resolution it holds that's big enough
+
+        The image's dpi is adjusted to match the resolution it's decoded at so
+        the sizes calculated from it are the same as for the full image.
+
+        @params:
+        source: the TIFF or JPEG2000 image
+        target: a function giving the size needed from the (full size) image
+        """
+        img = Image.open(source)
+        full = img.size
+        dpi = img.info.get('dpi', (72, 72))
+        width, height = target(img)
+
+        if img.format == 'JPEG2000':
+            # each resolution level halves the size
+            reduce = 0
+            levels = jp2_levels(source) or 0
+            while reduce < levels and (full[0] + (1 << reduce)) >> (reduce + 1) >= width and \
+                    (full[1] + (1 << reduce)) >> (reduce + 1) >= height:
+                reduce += 1
+            if reduce:
+                img.reduce = reduce
+                img.load()
+
+        elif img.format == 'TIFF' and getattr(img, 'n_frames', 1) > 1:
+            # the smallest of the reduced resolution pages (the same shape but
+            #  smaller than the first) that's still big enough
+            best = None
+            for frame in range(img.n_frames):
+                img.seek(frame)
+                w, h = img.size
+                if w < full[0] and w >= width and h >= height and abs(w * full[1] - h * full[0]) <= max(full) \
+                        and (best is None or w < best[1]):
+                    best = (frame, w)
+            img.seek(best[0] if best is not None else 0)
+
+        if img.size != full:
+            log.debug("Decoding %s at %sx%s instead of %sx%s" % (source, img.size[0], img.size[1], full[0], full[1]))
+            img.info['dpi'] = ((dpi[0] or 72) * float(img.size[0]) / full[0], (dpi[1] or 72) * float(img.size[1]) / full[1])
+        return img
+
+    def large(self, img):
+        """-resample 200 -resize '3000x3000>' -depth 8 -unsharp '1.5x1+0.7+0.02'"""
+        width, height = self.large_size(img)
+        img = self.depth8(img)
+        if (width, height) != img.size:
+            img = img.resize((width, height), Image.ANTIALIAS)
+
+        radius, percent, threshold = self.unsharp
+        return img.filter(ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold))
+
+    def large_size(self, img):
+        """The size of the large jpeg of the image: resampled and shrunk to fit the box"""
+        width, height = self.resampled_size(img)
+        scale = min(float(self.size[0]) / width, float(self.size[1]) / height, 1.0)
+        return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
+
+    def resampled_size(self, img):
+        """The size of the image at the target resolution"""
+        # images without a resolution are treated as 72dpi; as ImageMagick does
+        dpi = img.info.get('dpi', (72, 72))
+        width = int(round(img.size[0] * float(self.resolution) / (dpi[0] or 72)))
+        height = int(round(img.size[1] * float(self.resolution) / (dpi[1] or 72)))
+        return width, height
+
+    def resample(self, img):
+        """-resample 200 -depth 8"""
+        size = self.resampled_size(img)
+        img = self.depth8(img)
+        if size != img.size:
+            img = img.resize(size, Image.ANTIALIAS)
+        img.info['dpi'] = (self.resolution, self.resolution)
+        return img
+
+    def tiles(self, img, dzi_file):
+        """Write a Deep Zoom tile pyramid of the image
+
+        The tiles of level n (the image scaled to fit 2^n pixels) are written to
+        (name)_files/n/(column)_(row).jpg alongside the .dzi descriptor, which is
+        written last. Returns the files written.
+        """
+        tiles_folder = "%s_files" % os.path.splitext(dzi_file)[0]
+        width, height = img.size
+        top = int(math.ceil(math.log(max(width, height), 2)))
+
+        written = []
+        level = img
+        for n in range(top, -1, -1):
+            scale = 2 ** (top - n)
+            size = (max(int(math.ceil(float(width) / scale)), 1), max(int(math.ceil(float(height) / scale)), 1))
+            if size != level.size:
+                # each level is made from the one above it
+                level = level.resize(size, Image.ANTIALIAS)
+
+            folder = os.path.join(tiles_folder, str(n))
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+            for column in range(int(math.ceil(float(size[0]) / self.tile_size))):
+                for row in range(int(math.ceil(float(size[1]) / self.tile_size))):
+                    box = self.tile_box(column, row, size)
+                    tile = os.path.join(folder, "%s_%s.jpg" % (column, row))
+                    level.crop(box).save(tile, 'JPEG', quality=self.quality)
+                    written.append(tile)
+
+        fh = open(dzi_file, 'w')
+        fh.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="%s" Overlap="%s" Format="jpg">'
+            '<Size Width="%s" Height="%s"/></Image>\n' % (self.tile_size, self.tile_overlap, width, height))
+        fh.close()
+        written.append(dzi_file)
+        return written
+
+    def tile_box(self, column, row, size):
+        """The area of a level covered by a tile (including the overlap)"""
+        left = column * self.tile_size - (self.tile_overlap if column > 0 else 0)
+        top = row * self.tile_size - (self.tile_overlap if row > 0 else 0)
+        right = min((column + 1) * self.tile_size + self.tile_overlap, size[0])
+        bottom = min((row + 1) * self.tile_size + self.tile_overlap, size[1])
+        return (left, top, right, bottom)
+
+    def thumbnail(self, img):
+        """-thumbnail 100x200: fit the image to the box (growing it if needed)"""
+        scale = min(float(self.thumb_size[0]) / img.size[0], float(self.thumb_size[1]) / img.size[1])
+        width = max(int(round(img.size[0] * scale)), 1)
+        height = max(int(round(img.size[1] * scale)), 1)
+        return img.resize((width, height), Image.ANTIALIAS)
+
+    def depth8(self, img):
+        """Reduce the image to 8 bits per channel greyscale or RGB"""
+        if img.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+            return img.point(lambda i: i * (1 / 256.0)).convert('L')
+        elif img.mode in ('1', 'LA', 'F'):
+            return img.convert('L')
+        elif img.mode not in ('L', 'RGB'):
+            return img.convert('RGB')
+        return img
+
+def jp2_levels(path):
+    """The number of resolution levels (wavelet decompositions) in a JPEG2000 file
+
+    Read from the COD marker in the main header of the codestream. Returns None
+    if it can't be found.
+    """
+    fh = open(path, 'rb')
+    data = fh.read(1048576)
+    fh.close()
+
+    # the codestream starts with SOC followed by SIZ
+    pos = data.find('\xff\x4f\xff\x51')
+    if pos == -1:
+        return None
+
+    # walk the marker segments of the main header up to the first tile
+    pos += 2
+    while pos + 10 <= len(data):
+        marker, length = struct.unpack('>HH', data[pos:pos + 4])
+        if marker == 0xff52:
+            return ord(data[pos + 9])
+        if marker == 0xff90:
+            break
+        pos += 2 + length
+    return None
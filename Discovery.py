@@ -0,0 +1,204 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import hashlib
+import os
+import os.path
+from fnmatch import fnmatch
+
+# os.scandir (python 3.5+) or the scandir module; otherwise listdir and stat
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# get the logger
+log = logging.getLogger(__name__)
+
+# the names of the folders holding an item's page images (in order of
+#  preference) and OCR data; other cases of these names are accepted too
+IMAGE_FOLDERS = [ 'TIFF', 'TIF', 'tiff', 'tif' ]
+OCR_FOLDER = 'OCR'
+
+class Discovery:
+    """Find the items to process
+
+    The input folder is walked with a single directory listing per folder. Once
+    a folder is found to hold an item (a *-item.xml file) its files are
+    classified from that listing and its subfolders (the images and OCR) are
+    not walked. Alternatively the items can be read from a list of item folders
+    or item files and the walk skipped entirely.
+
+    When sharded, only the items which hash to this shard are yielded so that
+    several nodes can share out the input between them.
+    """
+    def __init__(self, input_folder, items_from=None, shard=None):
+        """
+        @params:
+        input_folder: the folder to walk
+        items_from: a file listing the items to process instead of walking
+        shard: (i, n) to only yield the items in shard i (1 to n) of n
+        """
+        self.input_folder = input_folder
+        self.items_from = items_from
+        self.shard = shard
+
+    def items(self):
+        """Yield the description of each item found"""
+        if self.items_from is not None:
+            return self.listed_items()
+        return self.walk(self.input_folder)
+
+    def walk(self, folder):
+        """Walk a folder, yielding items and only descending into non item folders"""
+        try:
+            entries = self.entries(folder)
+        except OSError, e:
+            log.error("Couldn't read %s: %s" % (folder, e))
+            return
+
+        # an item folder's subfolders are its images and OCR, whichever
+        #  shard its items are in
+        item_folder, items = self.classify(folder, entries)
+        if item_folder:
+            for item in items:
+                yield item
+            return
+
+        for name, is_dir in entries:
+            if is_dir:
+                for item in self.walk(os.path.join(folder, name)):
+                    yield item
+
+    def listed_items(self):
+        """Yield the items named in the items_from file (one folder or *-item.xml per line)"""
+        fh = open(self.items_from)
+        paths = [ line.strip() for line in fh if line.strip() and not line.startswith('#') ]
+        fh.close()
+
+        for path in paths:
+            if not os.path.isabs(path):
+                path = os.path.join(self.input_folder, path)
+
+            only = None
+            if not os.path.isdir(path):
+                path, only = os.path.split(path)
+
+            for item in self.items_in(path):
+                if only is None or os.path.basename(item['metadata_files'][0]) == only:
+                    yield item
+
+    def items_in(self, folder):
+        """The items in a single folder; an empty list if it isn't an item folder"""
+        try:
+            entries = self.entries(folder)
+        except OSError, e:
+            log.error("Couldn't read %s: %s" % (folder, e))
+            return []
+        return self.classify(folder, entries)[1]
+
+    def entries(self, folder):
+        """List a folder as (name, is a folder) tuples"""
+        if scandir is not None:
+            return [ (e.name, e.is_dir(follow_symlinks=False)) for e in scandir(folder) ]
+        return [ (f, os.path.isdir(os.path.join(folder, f)) and not os.path.islink(os.path.join(folder, f)))
+            for f in os.listdir(folder) ]
+
+    def classify(self, folder, entries):
+        """Describe the items in a folder from its listing
+
+        Returns a tuple of (is it an item folder, the items in this shard).
+        """
+        item_files = []
+        cat_files = []
+        pdf_file = None
+        image_dirs = []
+        ocr_dir = None
+        for name, is_dir in entries:
+            kind = folder_kind(name)
+            if kind is not None:
+                # the listing doesn't follow symlinks but these can be links
+                #  to the images or OCR kept elsewhere
+                path = os.path.join(folder, name)
+                if not is_dir and not os.path.isdir(path):
+                    continue
+                if kind == 'images':
+                    image_dirs.append(path)
+                elif ocr_dir is None or name == OCR_FOLDER:
+                    ocr_dir = path
+            elif is_dir:
+                continue
+            elif fnmatch(name, '*-item.xml'):
+                item_files.append(name)
+            elif fnmatch(name, '*-cat.xml'):
+                cat_files.append(os.path.join(folder, name))
+            elif fnmatch(name, '*.pdf'):
+                pdf_file = name
+
+        # the image folders in order of preference
+        image_dirs.sort(key=lambda d: image_folder_order(os.path.basename(d)))
+
+        items = []
+        for f in item_files:
+            if self.shard is not None and not in_shard(f.split('-')[0], f.split('-')[1], *self.shard):
+                continue
+
+            datafiles = {}
+            datafiles['dirpath'] = folder
+            datafiles['metadata_files'] = [ os.path.join(folder, f) ] + cat_files
+            datafiles['bibrecid'] = f.split('-')[0]
+            datafiles['item'] = f.split('-')[1]
+            datafiles['image_dirs'] = image_dirs
+            datafiles['ocr_dir'] = ocr_dir
+            if pdf_file is not None:
+                datafiles['pdf_data_file'] = pdf_file
+            items.append(datafiles)
+        return len(item_files) > 0, items
+
+def folder_kind(name):
+    """Is a folder name that of an item's 'images' or its 'ocr' (in any case)? None if neither"""
+    if name.upper() in [ f.upper() for f in IMAGE_FOLDERS ]:
+        return 'images'
+    if name.upper() == OCR_FOLDER.upper():
+        return 'ocr'
+    return None
+
+def image_folder_order(name):
+    """The sort key of an image folder name, in the order of IMAGE_FOLDERS and then in any other case"""
+    if name in IMAGE_FOLDERS:
+        return (0, IMAGE_FOLDERS.index(name))
+    return (1, [ f.upper() for f in IMAGE_FOLDERS ].index(name.upper()))
+
+def in_shard(bibrecid, item, i, n):
+    """Does the item belong to shard i (1 to n) of n?
+
+    The shard is decided by a hash of the item's bibrecid-item so it's the same
+    on every node and from run to run.
+    """
+    return int(hashlib.md5("%s-%s" % (bibrecid, item)).hexdigest(), 16) % n == i - 1
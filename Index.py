@@ -24,6 +24,15 @@
 
 import logging
 import requests
+import threading
+import Queue
+import time
+import itertools
+import json
+import os.path
+from xml.sax.saxutils import escape
+
+from Stats import *
 
 # get the logger
 log = logging.getLogger(__name__)
@@ -34,21 +43,104 @@ requests_log.setLevel(logging.ERROR)
 
 class Index:
     """All the required to manage submission to Solr"""
-    def __init__(self, solr):
+    def __init__(self, solr, batch_size=500, batch_bytes=5242880, commit_within=None,
+            senders=0, retries=3, backoff=1.0, dead_letter=None, stats=None, timeout=600):
         self.update_url = "%s/%s" % (solr, 'update?')
         log.debug("Solr: %s" % (self.update_url))
+
+        # the core admin API sits alongside the cores: (solr)/admin/cores
+        self.solr_base, self.core = solr.rstrip('/').rsplit('/', 1)
+        self.admin_url = "%s/admin/cores" % self.solr_base
         self.headers = { 'Content-type': 'text/xml; charset=utf-8' }
 
+        # the times and counters for the run
+        self.stats = stats if stats is not None else Stats()
+
+        # documents are gathered up and sent to solr in a single <add>
+        #  when either of these limits is reached
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.commit_within = commit_within
+        self.batch = []
+        self.batch_names = []
+        self.batch_length = 0
+
+        # one pooled session (and so one set of keep-alive connections)
+        #  for everything we send to solr
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(senders, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # server and connection errors are retried with an exponential backoff;
+        #  batches which still fail are written to the dead letter file
+        self.retries = retries
+        self.backoff = backoff
+
+        # how long (in seconds) to wait on solr before giving up on a request
+        #  (and retrying it) - without one a hung solr blocks a sender forever
+        self.timeout = timeout
+        self.dead_letter = dead_letter
+        self.lock = threading.Lock()
+
+        # the names of the documents solr has accepted; only kept when it's
+        #  set to a list (see pop_accepted)
+        self.accepted = None
+
+        # when senders are configured, flushed batches are handed off to
+        #  a pool of threads so that we're not waiting on every round trip
+        self.queue = Queue.Queue(max(senders, 1) * 2)
+        self.senders = []
+        for n in range(senders):
+            t = threading.Thread(target=self.send_batches, name="solr-sender-%s" % n)
+            t.daemon = True
+            t.start()
+            self.senders.append(t)
+
+    def post(self, msg, description):
+        """Post a message to solr, retrying server and connection errors
+
+        Returns the response or None if solr couldn't be reached.
+
+        @params:
+        msg: the update message or a function returning a fresh iterable of its
+            parts for each attempt (sent chunked)
+        description: what we're doing - used in the log messages
+        """
+        attempt = 0
+        while True:
+            try:
+                self.stats.incr('requests')
+                data = msg() if callable(msg) else msg
+                resp = self.session.post(self.update_url, data=data, headers=self.headers, timeout=self.timeout)
+                if resp.status_code < 500:
+                    return resp
+                log.warn("Solr returned %s while trying to %s." % (resp.status_code, description))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout), e:
+                resp = None
+                log.warn("Couldn't connect to solr while trying to %s: %s" % (description, e))
+
+            if attempt >= self.retries:
+                return resp
+
+            self.stats.incr('retries')
+            delay = self.backoff * (2 ** attempt)
+            log.info("Retrying in %s seconds." % delay)
+            time.sleep(delay)
+            attempt += 1
+
     def commit(self):
         """Commit the pending updates"""
+        self.join()
         msg = '<commit expungeDeletes="true"/>'
         log.debug("Commit message: %s" % msg)
-        resp = requests.post(self.update_url, msg, headers=self.headers)
-        if resp.status_code == 200:
+        resp = self.post(msg, 'commit the changes')
+        if resp is not None and resp.status_code == 200:
             log.debug("Successfully committed the changes.")
         else:
             log.error("Something went wrong trying to commit the changes.")
-            log.error("\n%s" % resp.text)
+            if resp is not None:
+                log.error("\n%s" % resp.text)
 
     def clean(self, match=None):
         """Delete all documents
@@ -59,31 +151,342 @@ class Index:
             msg = "<delete><query>%s</query></delete>" % match
         else:
             msg = "<delete><query>*:*</query></delete>"
-        resp = requests.post(self.update_url, msg, headers=self.headers)
+        resp = self.post(msg, 'wipe the index')
 
         log.debug("Purge message: %s" % msg)
-        if resp.status_code == 200:
+        if resp is not None and resp.status_code == 200:
             log.debug("Successfully submitted the index delete request.")
         else:
             log.error("Something went wrong trying to submit a request to wipe the index.")
-            log.error("\n%s" % resp.text)
+            if resp is not None:
+                log.error("\n%s" % resp.text)
+
+    def delete_ids(self, ids):
+        """Delete documents by id
+
+        Any pending documents are sent first. Returns True if solr accepted
+        all of the deletes.
+
+        @params:
+        ids: the ids of the documents to delete
+        """
+        self.join()
+        ok = True
+        for n in range(0, len(ids), self.batch_size):
+            chunk = ids[n:n + self.batch_size]
+            msg = "<delete>%s</delete>" % ''.join([ "<id>%s</id>" % escape(id) for id in chunk ])
+            resp = self.post(msg, 'delete %s documents' % len(chunk))
+            if resp is not None and resp.status_code == 200:
+                log.debug("Successfully deleted %s documents." % len(chunk))
+                self.stats.incr('documents_deleted', len(chunk))
+            else:
+                ok = False
+                log.error("Something went wrong trying to delete %s documents." % len(chunk))
+                if resp is not None:
+                    log.error("\n%s" % resp.text)
+        return ok
 
     def optimize(self):
         """Optimize the on disk index"""
+        self.join()
         msg = '<optimize waitSearcher="false"/>'
         log.debug("Optimize: message: %s" % msg)
-        resp = requests.post(self.update_url, msg, headers=self.headers)
-        if resp.status_code == 200:
+        resp = self.post(msg, 'optimize the index')
+        if resp is not None and resp.status_code == 200:
             log.debug("Successfully optimized the index.")
         else:
             log.error("Something went wrong trying to optimize the index.")
-            log.error("\n%s" % resp.text)
+            if resp is not None:
+                log.error("\n%s" % resp.text)
+
+    def swap(self, other):
+        """Swap this index's core with another one (eg. a freshly built core with the live one)
+
+        Any pending documents are sent first. Returns True if solr swapped the cores.
+
+        @params:
+        other: the name of the core to swap with
+        """
+        self.join()
+        params = { 'action': 'SWAP', 'core': self.core, 'other': other }
+        log.debug("Swapping cores: %s" % params)
+        try:
+            self.stats.incr('requests')
+            resp = self.session.get(self.admin_url, params=params, timeout=self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout), e:
+            log.error("Couldn't connect to solr while trying to swap %s with %s: %s" % (self.core, other, e))
+            return False
+
+        if resp.status_code == 200:
+            log.info("Swapped core %s with %s." % (self.core, other))
+            return True
+
+        log.error("Something went wrong trying to swap core %s with %s." % (self.core, other))
+        log.error("\n%s" % resp.text)
+        return False
+
+    def add(self, doc, document_name):
+        """Queue a document for submission in the next batch
+
+        @params:
+        doc: the serialised solr update message (an <add> wrapping the <doc>)
+        document_name: the name used to refer to the document in the logs
+        """
+        doc = self.document(doc, document_name)
+        if doc is None:
+            return
+
+        self.batch.append(doc)
+        self.batch_names.append(document_name)
+        self.batch_length += len(doc)
+
+        if len(self.batch) >= self.batch_size or self.batch_length >= self.batch_bytes:
+            self.flush()
+
+    def document(self, doc, document_name):
+        """Return the <doc> in an update message, or None if there isn't one"""
+        start = doc.find('<doc')
+        end = doc.rfind('</doc>')
+        if start == -1 or end == -1:
+            log.error("No solr document found in %s." % document_name)
+            return
+
+        return doc[start:end + len('</doc>')]
+
+    def add_tag(self):
+        """The opening tag of an <add>"""
+        if self.commit_within is not None:
+            return '<add commitWithin="%s">' % self.commit_within
+        return '<add>'
+
+    def flush(self):
+        """Submit the pending batch of documents in a single request"""
+        if not self.batch:
+            return
+
+        docs = self.batch
+        names = self.batch_names
+        self.batch = []
+        self.batch_names = []
+        self.batch_length = 0
+
+        if self.senders:
+            self.queue.put((None, names, True, docs))
+        else:
+            self.send_batch(None, names, docs=docs)
+
+    def send_batches(self):
+        """Sender thread: submit batches from the queue until told to stop"""
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is None:
+                    return
+                self.send_batch(*batch)
+            finally:
+                self.queue.task_done()
+
+    def send_batch(self, msg, names, dead_letter=True, docs=None):
+        """Submit a batch of documents; write it to the dead letter file on failure (if asked to)
+
+        When the batch's <doc>s are given, a batch solr rejects as a bad request
+        is split in two and each half sent again, so only the documents at fault
+        are lost.
+
+        @params:
+        msg: the update message (made from docs if None)
+        names: the names of the documents in the batch
+        dead_letter: write the batch to the dead letter file if it fails
+        docs: the <doc>s in the batch
+        """
+        if msg is None:
+            msg = '%s%s</add>' % (self.add_tag(), ''.join(docs))
+
+        log.debug("Submitting a batch of %s documents (%s bytes)." % (len(names), len(msg)))
+        with self.stats.timer('post'):
+            resp = self.post(msg, 'submit a batch of %s documents' % len(names))
+        if resp is not None and resp.status_code == 200:
+            log.debug("Batch of %s documents successfully submitted for indexing." % len(names))
+            self.stats.incr('documents_posted', len(names))
+            if self.accepted is not None:
+                with self.lock:
+                    self.accepted.extend(names)
+            return True
+
+        if resp is not None and resp.status_code == 400 and docs is not None and len(docs) > 1:
+            log.warn("Solr rejected a batch of %s documents; sending it in halves to find the bad ones." % len(docs))
+            self.stats.incr('batches_split')
+            msg = None
+            half = len(docs) // 2
+            first = self.send_batch(None, names[:half], dead_letter, docs[:half])
+            second = self.send_batch(None, names[half:], dead_letter, docs[half:])
+            return first and second
+
+        self.stats.incr('documents_failed', len(names))
+        error = resp.status_code if resp is not None else 'no connection'
+        log.error("Submission of a batch of %s documents failed with error %s." % (len(names), error))
+        for name in names:
+            log.error("Not indexed: %s" % name)
+        if dead_letter:
+            self.write_dead_letter(msg, names)
+        return False
+
+    def stream(self, documents, description):
+        """Submit documents in a single request, sending each one as it's generated
+
+        The request body is sent with chunked transfer encoding so the whole
+        message is never held in memory. Failed requests are retried like any
+        other (the documents are generated again for each attempt) and if solr
+        still won't take them they're written to the dead letter file. Returns
+        True if solr accepted the documents.
+
+        @params:
+        documents: a list of (document name, update message) tuples or a function
+            returning an iterable of them
+        description: what's being sent (eg. the item) - used in the log messages
+        """
+        generate = documents if callable(documents) else lambda: iter(documents)
+
+        # don't bother solr if there's nothing to send; what's been looked at
+        #  is used for the first attempt
+        first = iter(generate())
+        try:
+            first = [ itertools.chain([ next(first) ], first) ]
+        except StopIteration:
+            return True
+
+        names = []
+
+        def body():
+            del names[:]
+            yield self.add_tag()
+            for name, doc in (first.pop() if first else generate()):
+                doc = self.document(doc, name)
+                if doc is None:
+                    continue
+                names.append(name)
+                yield doc.encode('utf-8') if isinstance(doc, unicode) else doc
+            yield '</add>'
+
+        log.debug("Streaming the documents of %s." % description)
+        with self.stats.timer('post'):
+            resp = self.post(body, 'stream %s' % description)
+
+        if resp is not None and resp.status_code == 200:
+            log.debug("%s documents of %s successfully submitted for indexing." % (len(names), description))
+            self.stats.incr('documents_posted', len(names))
+            if self.accepted is not None:
+                with self.lock:
+                    self.accepted.extend(names)
+            return True
+
+        # the documents are generated once more, straight into the dead letter
+        #  file (or just to find out what wasn't sent)
+        if self.dead_letter is not None:
+            self.write_dead_letter(body(), names)
+        else:
+            for part in body():
+                pass
+
+        self.stats.incr('documents_failed', len(names))
+        error = resp.status_code if resp is not None else 'no connection'
+        log.error("Streaming the documents of %s failed with error %s." % (description, error))
+        for name in names:
+            log.error("Not indexed: %s" % name)
+        return False
+
+    def write_dead_letter(self, msg, names):
+        """Save a failed update message so that it can be replayed later
+
+        @params:
+        msg: the update message or an iterable of its parts, which are written as
+            they're generated
+        names: the names of the documents in the message (complete once msg is)
+        """
+        if self.dead_letter is None:
+            return
+
+        parts = [ msg ] if isinstance(msg, basestring) else msg
+        with self.lock:
+            # one JSON object per line: { "body": message, "names": [ name ] }
+            fh = open(self.dead_letter, 'a')
+            fh.write('{"body": "')
+            for part in parts:
+                fh.write(json.dumps(part)[1:-1])
+            fh.write('", "names": %s}\n' % json.dumps(names))
+            fh.close()
+
+    def replay(self, dead_letter):
+        """Resubmit the update messages saved in a dead letter file
+
+        Messages that fail again are written to this index's dead letter file or,
+        if it doesn't have one, left in the file being replayed.
+
+        @params:
+        dead_letter: the dead letter file to replay
+        """
+        if not os.path.exists(dead_letter):
+            log.error("Can't find the dead letter file: %s" % dead_letter)
+            return
+
+        fh = open(dead_letter)
+        messages = [ json.loads(line) for line in fh if line.strip() ]
+        fh.close()
+
+        log.info("Replaying %s messages from %s" % (len(messages), dead_letter))
+        failed = [ m for m in messages if not self.send_batch(m['body'].encode('utf-8'), m['names'], dead_letter=False) ]
+
+        if self.dead_letter is not None and os.path.abspath(self.dead_letter) != os.path.abspath(dead_letter):
+            for m in failed:
+                self.write_dead_letter(m['body'], m['names'])
+            os.remove(dead_letter)
+        elif failed:
+            # replace the file with what failed again; it's never left half written
+            tmp = "%s.tmp" % dead_letter
+            fh = open(tmp, 'w')
+            for m in failed:
+                fh.write("%s\n" % json.dumps(m))
+            fh.close()
+            os.rename(tmp, dead_letter)
+        else:
+            os.remove(dead_letter)
+
+        if failed:
+            log.error("%s of the %s replayed messages failed again" % (len(failed), len(messages)))
+
+    def pop_accepted(self):
+        """Return the names of the documents solr has accepted since the last call"""
+        with self.lock:
+            accepted = self.accepted if self.accepted is not None else []
+            self.accepted = []
+        return accepted
+
+    def join(self):
+        """Send any pending documents and wait for the senders to finish"""
+        self.flush()
+        if self.senders:
+            self.queue.join()
+
+    def close(self):
+        """Wait for all pending documents to be sent and stop the senders"""
+        self.join()
+        for t in self.senders:
+            self.queue.put(None)
+        for t in self.senders:
+            t.join()
+        self.senders = []
+        self.session.close()
 
     def submit(self, doc, document_name):
         """Submit the document for indexing"""
-        resp = requests.post(self.update_url, data=doc, headers=self.headers)
-        if resp.status_code == 200:
+        with self.stats.timer('post'):
+            resp = self.post(doc, 'submit %s' % document_name)
+        if resp is not None and resp.status_code == 200:
             log.debug("%s successfully submitted for indexing." % document_name)
+            self.stats.incr('documents_posted')
         else:
-            log.error("Submission of %s failed with error %s." % (document_name, resp.status_code))
+            self.stats.incr('documents_failed')
+            error = resp.status_code if resp is not None else 'no connection'
+            log.error("Submission of %s failed with error %s." % (document_name, error))
+            self.write_dead_letter(doc, [ document_name ])
 
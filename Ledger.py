@@ -0,0 +1,79 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import hashlib
+
+from RunStore import *
+
+# get the logger
+log = logging.getLogger(__name__)
+
+class Ledger(RunStore):
+    """A record of the solr stubs that solr has accepted
+
+    Each stub is stored with its document id and a hash of its content so that
+    the post stage can send only the stubs which are new or have changed, and
+    can ask solr to delete the documents whose stubs have gone.
+    """
+    table = 'documents'
+    keys = ('path',)
+    values = ('id', 'hash')
+
+    def __init__(self, path):
+        log.debug("Ledger: %s" % path)
+        RunStore.__init__(self, path)
+
+    def hash(self, data):
+        """The sha1 of a stub's content"""
+        return hashlib.sha1(data).hexdigest()
+
+    def changed(self, path, hash):
+        """Has the stub changed since solr last accepted it?
+
+        The stub is marked as seen in this run either way.
+
+        @params:
+        path: the stub file
+        hash: the hash of the stub's content
+        """
+        row = self.seen((path,))
+        return row is None or row[1] != hash
+
+    def accepted(self, path, id, hash):
+        """Record a stub that solr has accepted"""
+        self.store((path,), (id, hash))
+
+    def removed(self):
+        """The stubs recorded in earlier runs which weren't seen in this one
+
+        Only meaningful once all the stubs have been walked. Returns a list of
+        (path, id) tuples.
+        """
+        return [ (path, id) for path, id, hash in self.unseen() ]
+
+    def remove(self, path):
+        """Forget about a stub"""
+        self.forget((path,))
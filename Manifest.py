@@ -0,0 +1,110 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import hashlib
+import os
+import os.path
+
+from RunStore import *
+
+# get the logger
+log = logging.getLogger(__name__)
+
+class Manifest(RunStore):
+    """A record of the inputs of every item the crawler has processed
+
+    Each item is stored with a signature of its input files (names, sizes, mtimes
+    and optionally content hashes) so that a later run can skip items whose inputs
+    haven't changed, and can tell which items have disappeared from the input.
+    """
+    table = 'items'
+    keys = ('dirpath', 'item')
+    values = ('signature',)
+
+    def __init__(self, path, hashes=False):
+        log.debug("Manifest: %s" % path)
+        RunStore.__init__(self, path)
+        self.hashes = hashes
+
+    def signature(self, files, options=None):
+        """Calculate the signature of a set of input files
+
+        @params:
+        files: the paths of the input files
+        options: a description of the options the output is made with, if any
+        """
+        s = hashlib.sha1()
+        if options:
+            s.update("options\t%s\n" % options)
+        for f in sorted(files):
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            s.update("%s\t%s\t%s\n" % (f, st.st_size, int(st.st_mtime)))
+            if self.hashes:
+                s.update(self.hash(f))
+        return s.hexdigest()
+
+    def hash(self, f):
+        """The md5 of a file's content"""
+        h = hashlib.md5()
+        fh = open(f, 'rb')
+        for block in iter(lambda: fh.read(1048576), ''):
+            h.update(block)
+        fh.close()
+        return h.hexdigest()
+
+    def changed(self, dirpath, item, signature):
+        """Has the item changed since it was last recorded?
+
+        The item is marked as seen in this run either way.
+
+        @params:
+        dirpath: the item folder
+        item: the item identifier (bibrecid-item)
+        signature: the signature of the item's inputs
+        """
+        row = self.seen((dirpath, item))
+        return row is None or row[0] != signature
+
+    def record(self, dirpath, item, signature):
+        """Record an item that has been successfully processed"""
+        self.store((dirpath, item), (signature,))
+        self.db.commit()
+
+    def disappeared(self):
+        """The items recorded in earlier runs which weren't seen in this one
+
+        Only meaningful once the whole input has been walked. Returns a list of
+        (dirpath, item) tuples.
+        """
+        return [ (dirpath, item) for dirpath, item, signature in self.unseen() ]
+
+    def remove(self, dirpath, item):
+        """Forget about an item"""
+        self.forget((dirpath, item))
+        self.db.commit()
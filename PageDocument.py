@@ -0,0 +1,53 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+from lxml import etree
+
+class PageDocument:
+    """Build the solr documents for the pages of an item
+
+    The item's metadata fields are serialised once and shared by every page; each
+    page document is then assembled and serialised exactly once.
+    """
+    def __init__(self, metadata):
+        """@params:
+        metadata: the item metadata; an lxml <add><doc> document
+        """
+        self.fields = [ self.field(f.get('name'), f.text) for f in metadata.xpath('/add/doc/field') ]
+
+    def field(self, name, value):
+        """Serialise a field"""
+        f = etree.Element('field', name=name)
+        f.text = value
+        return etree.tostring(f)
+
+    def build(self, fields):
+        """Return the serialised solr document for a page
+
+        @params:
+        fields: a list of (name, value) tuples of the page's fields
+        """
+        fields = self.fields + [ self.field(name, value) for name, value in fields ]
+        return "<add>\n  <doc>\n    %s\n  </doc>\n</add>\n" % "\n    ".join(fields)
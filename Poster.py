@@ -0,0 +1,266 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import threading
+import Queue
+import os
+import os.path
+import re
+from lxml import etree
+from xml.sax.saxutils import unescape
+
+from Stats import *
+
+# get the logger
+log = logging.getLogger(__name__)
+
+# the id field of a solr stub
+ID_FIELD = re.compile(r'<field name="id">([^<]*)</field>')
+
+class Poster:
+    """Read the solr stub files and hand them to the indexer
+
+    The stub files are read as they are (no parsing and reserialising) by a
+    small pool of reader threads which keep a bounded queue of documents
+    filled while the indexer is busy talking to solr.
+
+    With a ledger only the stubs which are new or have changed since solr last
+    accepted them are sent, and the documents whose stubs have gone are deleted.
+
+    When streaming, the stubs of each solr folder (ie. item) are sent in one
+    chunked request as they're read instead of being batched.
+    """
+    def __init__(self, index, readers=2, validate=False, prefetch=100, ledger=None, full=False, stream=False,
+            stats=None):
+        """
+        @params:
+        index: the Index the documents are added to
+        readers: the number of threads reading the stub files (0 to read them inline)
+        validate: parse each stub to check it's well formed XML before it's sent
+        prefetch: how many documents may be read ahead of the indexer
+        ledger: the Ledger of the stubs solr has accepted
+        full: send every stub, changed or not (the ledger is still updated)
+        stream: send the stubs of each solr folder in a single streamed request
+        """
+        self.index = index
+        self.readers = readers
+        self.validate = validate
+        self.prefetch = prefetch
+        self.stats = stats if stats is not None else Stats()
+
+        self.ledger = ledger
+        self.full = full
+        self.stream = stream
+        self.pending = {}
+        self.seen = set()
+        if ledger is not None:
+            # start keeping track of what solr accepts
+            self.index.pop_accepted()
+
+    def run(self, folder, n=None):
+        """Post the stubs in each solr folder found under folder
+
+        @params:
+        folder: where to look for the solr folders
+        n: stop after this many solr folders
+        """
+        if self.stream:
+            for dirpath, paths in self.find_folders(folder, n):
+                self.index.stream(lambda paths=paths: self.stream_stubs(paths), dirpath)
+                if self.ledger is not None:
+                    self.record_accepted()
+        elif self.readers < 1:
+            for path in self.find_stubs(folder, n):
+                self.post(path, self.read(path))
+        else:
+            self.read_ahead(folder, n)
+
+        if self.ledger is not None:
+            self.finish(n is None)
+
+    def read_ahead(self, folder, n):
+        """Post the stubs as they're read by the reader threads"""
+        paths = Queue.Queue(self.prefetch)
+        documents = Queue.Queue(self.prefetch)
+
+        threads = [ threading.Thread(target=self.find_all, args=(folder, n, paths), name="stub-finder") ]
+        for i in range(self.readers):
+            threads.append(threading.Thread(target=self.read_all, args=(paths, documents), name="stub-reader-%s" % i))
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # each reader says when it's done
+        finished = 0
+        while finished < self.readers:
+            document = documents.get()
+            if document is None:
+                finished += 1
+            else:
+                self.post(*document)
+
+        for t in threads:
+            t.join()
+
+    def find_folders(self, folder, n=None):
+        """Yield each solr folder under folder with the paths of the stub files in it"""
+        count = 0
+        for (dirpath, dirnames, filenames) in os.walk(folder):
+            if os.path.basename(dirpath) == 'solr':
+                count += 1
+                log.info("Processing: %s: %s" % (count, dirpath))
+                yield dirpath, [ os.path.join(dirpath, f) for f in filenames ]
+
+            if n is not None and count == int(n):
+                break
+
+    def find_stubs(self, folder, n=None):
+        """Yield the path of each stub file in the solr folders under folder"""
+        for dirpath, paths in self.find_folders(folder, n):
+            for path in paths:
+                yield path
+
+    def stream_stubs(self, paths):
+        """Read the stubs as they're streamed to solr, yielding those to send"""
+        for path in paths:
+            data = self.read(path)
+            if self.wanted(path, data):
+                yield path, data
+
+    def find_all(self, folder, n, paths):
+        """Finder thread: queue the path of each stub file for the readers"""
+        try:
+            for path in self.find_stubs(folder, n):
+                paths.put(path)
+        finally:
+            for i in range(self.readers):
+                paths.put(None)
+
+    def read_all(self, paths, documents):
+        """Reader thread: read the queued stub files until told to stop"""
+        try:
+            while True:
+                path = paths.get()
+                if path is None:
+                    return
+                documents.put((path, self.read(path)))
+        finally:
+            documents.put(None)
+
+    def read(self, path):
+        """Return the contents of a stub file or None if it couldn't be read"""
+        try:
+            with self.stats.timer('read'):
+                fh = open(path, 'rb')
+                data = fh.read()
+                fh.close()
+        except IOError, e:
+            log.error("Couldn't read %s: %s" % (path, e))
+            return None
+
+        self.stats.incr('stubs_read')
+        self.stats.incr('bytes_read', len(data))
+        return data
+
+    def check(self, path, data):
+        """Is this something we can send to solr?"""
+        if data is None:
+            return False
+
+        if '</doc>' not in data:
+            log.error("No solr document found in %s." % path)
+            return False
+
+        if self.validate:
+            try:
+                with self.stats.timer('validate'):
+                    etree.fromstring(data)
+            except etree.XMLSyntaxError, e:
+                log.error("Invalid solr document: %s: %s" % (path, e))
+                return False
+
+        return True
+
+    def post(self, path, data):
+        """Hand a stub to the indexer"""
+        if self.wanted(path, data):
+            self.index.add(data, path)
+
+    def wanted(self, path, data):
+        """Should this stub be sent to solr?"""
+        if not self.check(path, data):
+            self.stats.incr('stubs_invalid')
+            if self.ledger is not None:
+                # leave what solr has alone until the stub is fixed
+                self.ledger.changed(path, None)
+            return False
+
+        if self.ledger is not None:
+            match = ID_FIELD.search(data)
+            id = unescape(match.group(1)) if match is not None else None
+            hash = self.ledger.hash(data)
+            self.seen.add(id)
+            if not self.ledger.changed(path, hash) and not self.full:
+                self.stats.incr('stubs_unchanged')
+                return False
+            self.pending[path] = (id, hash)
+            self.record_accepted()
+
+        return True
+
+    def record_accepted(self):
+        """Add the stubs solr has accepted to the ledger"""
+        for path in self.index.pop_accepted():
+            if path in self.pending:
+                id, hash = self.pending.pop(path)
+                self.ledger.accepted(path, id, hash)
+
+    def finish(self, complete):
+        """Wait for solr to accept the stubs sent and delete the documents whose stubs have gone
+
+        @params:
+        complete: were all of the stubs walked? Nothing is deleted if not.
+        """
+        self.index.join()
+        self.record_accepted()
+        if not complete:
+            return
+
+        removed = []
+        for path, id in self.ledger.removed():
+            if id in self.seen:
+                # the document is still there; it's just in another file
+                self.ledger.remove(path)
+            else:
+                removed.append((path, id))
+
+        if not removed:
+            return
+
+        log.info("Deleting %s documents whose stubs have gone" % len(removed))
+        if self.index.delete_ids([ id for path, id in removed if id is not None ]):
+            for path, id in removed:
+                self.ledger.remove(path)
@@ -0,0 +1,91 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import sqlite3
+from datetime import datetime
+
+# get the logger
+log = logging.getLogger(__name__)
+
+class RunStore:
+    """An sqlite table of records, each marked with the last run that saw it
+
+    Every run is numbered in a runs table. A record is marked with the run
+    when it's looked up or stored, so the records which weren't seen in this
+    run (eg. the inputs that have gone) are those marked with an earlier one.
+
+    Subclasses name the table and its key and value columns (all text).
+    """
+    table = None
+    keys = ()
+    values = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS %s (%s, run INTEGER, PRIMARY KEY (%s))' % (self.table,
+            ', '.join([ "%s TEXT" % c for c in self.keys + self.values ]), ', '.join(self.keys)))
+        self.db.execute('''CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, started TEXT)''')
+
+        # every record seen in this run is marked with the run id
+        cursor = self.db.execute('INSERT INTO runs (started) VALUES (?)', (datetime.now().isoformat(),))
+        self.run = cursor.lastrowid
+        self.db.commit()
+
+        self.match = ' AND '.join([ "%s = ?" % c for c in self.keys ])
+
+    def seen(self, key):
+        """Return the values recorded for a key (None if there's no record), marking it as seen in this run
+
+        @params:
+        key: a tuple of the key columns' values
+        """
+        row = self.db.execute('SELECT %s FROM %s WHERE %s' % (', '.join(self.values), self.table, self.match),
+            key).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE %s SET run = ? WHERE %s' % (self.table, self.match), (self.run,) + key)
+        return row
+
+    def store(self, key, values):
+        """Record the values for a key as seen in this run"""
+        columns = self.keys + self.values + ('run',)
+        self.db.execute('INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (self.table, ', '.join(columns),
+            ', '.join([ '?' ] * len(columns))), key + values + (self.run,))
+
+    def unseen(self):
+        """The records (their keys and then values) stored in earlier runs which weren't seen in this one"""
+        self.db.commit()
+        return self.db.execute('SELECT %s FROM %s WHERE run < ?' % (', '.join(self.keys + self.values), self.table),
+            (self.run,)).fetchall()
+
+    def forget(self, key):
+        """Remove the record of a key"""
+        self.db.execute('DELETE FROM %s WHERE %s' % (self.table, self.match), key)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
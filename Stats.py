@@ -0,0 +1,163 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import logging
+import threading
+import time
+import json
+import glob
+import os
+import os.path
+import cProfile
+import pstats
+from contextlib import contextmanager
+
+# get the logger
+log = logging.getLogger(__name__)
+
+class Stats:
+    """Wall time and counters for the stages of a run
+
+    The time of a stage doesn't include the time of the stages nested inside
+    it (eg. ocr within pages), so the stages of a thread add up to no more than
+    its wall time. Stages in different threads or worker processes overlap.
+
+    When a profile folder is given each stage is also run under cProfile and
+    the statistics for each stage are written to (folder)/(stage).prof.
+    """
+    def __init__(self, profile=None):
+        self.times = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+        # one profiler per stage per thread; nested stages are included
+        #  in the profile of the outermost one
+        self.profile = profile
+        self.profilers = {}
+        self.local = threading.local()
+
+    @contextmanager
+    def timer(self, stage):
+        """Time (and maybe profile) a block of code as part of a stage"""
+        profiler = None
+        if self.profile is not None and getattr(self.local, 'stage', None) is None:
+            key = (stage, threading.current_thread().name)
+            with self.lock:
+                profiler = self.profilers.setdefault(key, cProfile.Profile())
+            self.local.stage = stage
+            profiler.enable()
+
+        # the time spent in the stages nested in each of this thread's open stages
+        if getattr(self.local, 'nested', None) is None:
+            self.local.nested = []
+        nested = self.local.nested
+        nested.append(0.0)
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.add_time(stage, elapsed - nested.pop())
+            if nested:
+                nested[-1] += elapsed
+            if profiler is not None:
+                profiler.disable()
+                self.local.stage = None
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            self.times[stage] = self.times.get(stage, 0) + seconds
+
+    def incr(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def pop(self):
+        """Return the times and counters collected so far and start again"""
+        with self.lock:
+            stats = { 'times': self.times, 'counters': self.counters }
+            self.times = {}
+            self.counters = {}
+        return stats
+
+    def merge(self, stats):
+        """Add in the times and counters from another Stats (eg. a worker's pop())"""
+        with self.lock:
+            for stage, seconds in stats['times'].items():
+                self.times[stage] = self.times.get(stage, 0) + seconds
+            for counter, n in stats['counters'].items():
+                self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def summary(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed': time.time() - self.started,
+            'times': self.times,
+            'counters': self.counters,
+        }
+
+    def write(self, path):
+        """Write the summary of the run as JSON"""
+        fh = open(path, 'w')
+        fh.write(json.dumps(self.summary(), indent=2, sort_keys=True))
+        fh.close()
+
+    def dump_profiles(self, suffix=None):
+        """Write the profile of each stage to the profile folder
+
+        Worker processes write (stage).(suffix).prof; merge_profiles combines
+        these with the main process' profiles.
+        """
+        if self.profile is None:
+            return
+
+        with self.lock:
+            stages = {}
+            for (stage, thread), profiler in self.profilers.items():
+                stages.setdefault(stage, []).append(profiler)
+
+        for stage, profilers in stages.items():
+            name = stage if suffix is None else "%s.%s" % (stage, suffix)
+            try:
+                pstats.Stats(*profilers).dump_stats(os.path.join(self.profile, "%s.prof" % name))
+            except TypeError:
+                # a profiler which never ran has no stats
+                pass
+
+    def merge_profiles(self):
+        """Write this process' profiles and fold in those written by the workers"""
+        if self.profile is None:
+            return
+
+        self.dump_profiles()
+        for path in glob.glob(os.path.join(self.profile, '*.*.prof')):
+            stage = os.path.basename(path).split('.')[0]
+            merged = os.path.join(self.profile, "%s.prof" % stage)
+            files = [ merged, path ] if os.path.exists(merged) else [ path ]
+            pstats.Stats(*files).dump_stats(merged)
+            os.remove(path)
+        log.info("Profiles written to %s" % self.profile)
@@ -0,0 +1,320 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+import logging
+import os
+import os.path
+import time
+
+# inotify is optional - without it (or on network shares, where it doesn't
+#  see changes made by other machines) the input is scanned periodically
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from Discovery import *
+from Stats import *
+
+# get the logger
+log = logging.getLogger(__name__)
+
+# the file systems inotify can't be relied on for
+NETWORK_FILESYSTEMS = [ 'cifs', 'smbfs', 'smb3', 'nfs', 'nfs4', 'fuse.sshfs' ]
+
+class Watcher:
+    """Process the items which are added to or changed in the input as they land
+
+    Item folders are queued when a change is seen (by inotify or by a periodic
+    scan) and processed with the crawler once nothing in them has changed for
+    the settle time. Their page documents go wherever the crawler sends them
+    (eg. the indexer).
+    """
+    def __init__(self, crawler, index=None, interval=60, settle=30, poll=False, stats=None, deep_interval=3600):
+        """
+        @params:
+        crawler: the Crawler used to process the items
+        index: the Index the page documents are sent to (committed after each set of items)
+        interval: the number of seconds between scans of the input
+        settle: how long (in seconds) an item must be left alone before it's processed
+        poll: scan the input even if inotify is available
+        deep_interval: the number of seconds between scans which also look at every page
+            file (to see pages rewritten in place)
+        """
+        self.crawler = crawler
+        self.index = index
+        self.interval = interval
+        self.settle = settle
+        self.deep_interval = deep_interval
+        self.stats = stats if stats is not None else Stats()
+        self.discovery = Discovery(crawler.input_folder, shard=crawler.shard)
+        self.scanner = ScanDiscovery(crawler.input_folder, shard=crawler.shard)
+
+        self.inotify = pyinotify is not None and not poll
+        if self.inotify and filesystem(crawler.input_folder) in NETWORK_FILESYSTEMS:
+            log.info("%s is on a network share; scanning it instead of using inotify" % crawler.input_folder)
+            self.inotify = False
+
+        # inotify works with absolute paths whatever the input was given as
+        self.root = os.path.abspath(crawler.input_folder)
+
+        # the signature of each item found by the last scan (and by the last
+        #  deep scan) and the item folders waiting to settle: folder -> time
+        #  of the last change
+        self.signatures = {}
+        self.deep_signatures = {}
+        self.deep_scanned = 0
+        self.pending = {}
+        self.count = 0
+
+    def run(self):
+        """Watch the input until interrupted"""
+        if self.crawler.changes is not None:
+            self.crawler.changes_file = open(self.crawler.changes, 'a')
+
+        try:
+            # with a manifest anything that changed while we weren't watching
+            #  is processed straight away; otherwise this is where we start from
+            log.info("Scanning %s" % self.crawler.input_folder)
+            self.scan(initial=True)
+            self.process_settled()
+
+            # inotify may not be able to watch it all (eg. max_user_watches)
+            if not self.inotify or not self.watch():
+                while True:
+                    time.sleep(min(self.interval, self.settle) if self.pending else self.interval)
+                    self.scan()
+                    self.process_settled()
+        finally:
+            if self.crawler.changes is not None:
+                self.crawler.changes_file.close()
+
+    def watch(self):
+        """Wait for inotify events, processing the items as they settle
+
+        Returns False (having dropped the watches) if a folder couldn't be
+        watched, leaving the input to be scanned instead.
+        """
+        log.info("Watching %s with inotify" % self.crawler.input_folder)
+        self.wm = pyinotify.WatchManager()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE | \
+            pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM
+        notifier = pyinotify.Notifier(self.wm, self.event, timeout=min(self.interval, self.settle) * 1000)
+        self.unwatched = None
+        try:
+            wds = self.wm.add_watch(self.root, mask, rec=True, auto_add=True)
+            failed = [ path for path, wd in wds.items() if wd < 0 ]
+            if failed:
+                self.unwatched = failed[0]
+
+            while self.unwatched is None:
+                if notifier.check_events():
+                    notifier.read_events()
+                    notifier.process_events()
+                self.process_settled()
+        finally:
+            notifier.stop()
+
+        log.warning("Couldn't watch %s (see fs.inotify.max_user_watches); scanning %s every %d seconds instead" %
+            (self.unwatched, self.crawler.input_folder, self.interval))
+        self.inotify = False
+        return False
+
+    def event(self, event):
+        """Queue the item folder an inotify event happened in"""
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            # events were lost; look for the changes they were about
+            log.warning("The inotify queue overflowed; scanning %s" % self.crawler.input_folder)
+            self.scan()
+            return
+
+        # new folders are watched as they're created, unless we've run out of watches
+        pathname = os.path.abspath(event.pathname)
+        if event.dir and event.mask & (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO) and \
+                os.path.isdir(pathname) and self.wm.get_wd(pathname) is None:
+            self.unwatched = pathname
+
+        # the folder as the walk of the input names it
+        folder = pathname if event.dir else os.path.dirname(pathname)
+        relative = os.path.relpath(folder, self.root)
+        folder = self.crawler.input_folder if relative == '.' else os.path.join(self.crawler.input_folder, relative)
+        if folder_kind(os.path.basename(folder)) is not None:
+            folder = os.path.dirname(folder)
+        self.pending[folder] = time.time()
+
+    def scan(self, initial=False):
+        """Walk the input queueing the items whose folders have changed since the last scan
+
+        Every scan looks at the item files and the image and OCR folders, which
+        is enough to see pages being added or removed. The page files are only
+        looked at every deep_interval seconds (inotify sees them change) and in
+        the folders still waiting to settle.
+        """
+        now = time.time()
+        deep = not self.inotify and now - self.deep_scanned >= self.deep_interval
+        if deep:
+            self.deep_scanned = now
+
+        with self.stats.timer('discover'):
+            signatures = {}
+            deep_signatures = {}
+            for datafiles in self.scanner.items():
+                folder = datafiles['dirpath']
+                signatures[folder] = signatures.get(folder, ()) + (self.signature(datafiles),)
+                if deep or folder in self.pending:
+                    deep_signatures[folder] = deep_signatures.get(folder, ()) + (self.signature(datafiles, True),)
+            self.scanner.forget()
+
+        for folder, signature in signatures.items():
+            rewritten = folder in deep_signatures and folder in self.deep_signatures and \
+                deep_signatures[folder] != self.deep_signatures[folder]
+            if self.signatures.get(folder) == signature and not rewritten:
+                continue
+
+            if not initial:
+                self.pending[folder] = now
+            elif self.crawler.manifest is not None:
+                # nothing to wait for; it's been there since before we started
+                self.pending[folder] = 0
+        self.signatures = signatures
+        for folder in signatures:
+            if folder in deep_signatures:
+                self.deep_signatures[folder] = deep_signatures[folder]
+        for folder in self.deep_signatures.keys():
+            if folder not in signatures:
+                del self.deep_signatures[folder]
+
+    def signature(self, datafiles, deep=False):
+        """A digest of the sizes and mtimes of an item's files and folders
+
+        A folder's mtime changes when files are added to or removed from it, so
+        that's enough to see new and removed pages. A deep signature is of the
+        files in the image and OCR folders too, to see pages rewritten in place
+        (the folders are only listed again when they've changed).
+        """
+        folders = datafiles['image_dirs'] + ([ datafiles['ocr_dir'] ] if datafiles['ocr_dir'] is not None else [])
+        paths = datafiles['metadata_files'] + folders
+        if deep:
+            for folder in folders:
+                try:
+                    paths.extend([ os.path.join(folder, name) for name, is_dir in self.scanner.entries(folder) if not is_dir ])
+                except OSError:
+                    continue
+
+        digest = hashlib.md5()
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            digest.update("%s %d %r\n" % (path, st.st_size, st.st_mtime))
+        return digest.digest()
+
+    def process_settled(self):
+        """Process the items that haven't changed for the settle time"""
+        now = time.time()
+        settled = sorted([ f for f, changed in self.pending.items() if now - changed >= self.settle ])
+        if not settled:
+            return
+
+        for folder in settled:
+            del self.pending[folder]
+
+        processed = 0
+        done = set()
+        for folder in settled:
+            if not os.path.isdir(folder):
+                continue
+
+            # a new folder may hold whole items that were copied in before
+            #  there was a watch on it; those still changing are left to settle
+            for datafiles in self.discovery.walk(folder):
+                if datafiles['dirpath'] in self.pending or datafiles['metadata_files'][0] in done:
+                    continue
+                done.add(datafiles['metadata_files'][0])
+
+                self.count += 1
+                datafiles['count'] = self.count
+                if self.crawler.manifest is not None and not self.crawler.changed(datafiles):
+                    continue
+
+                log.info("Processing new or changed item: %s-%s" % (datafiles['bibrecid'], datafiles['item']))
+                self.crawler.processed(datafiles, self.crawler.process_item(datafiles))
+                processed += 1
+
+        # make the new pages searchable
+        if processed and self.index is not None:
+            self.index.join()
+            if self.index.commit_within is None:
+                self.index.commit()
+
+class ScanDiscovery(Discovery):
+    """A Discovery which only lists the folders that have changed since the last walk
+
+    A folder's mtime changes when entries are added to or removed from it, so
+    the listing from the last walk is reused while it hasn't. Each folder is
+    still visited (a change deep in the tree doesn't touch its ancestors) but
+    that's a stat rather than a listing.
+    """
+    def __init__(self, input_folder, items_from=None, shard=None):
+        Discovery.__init__(self, input_folder, items_from, shard)
+
+        # folder -> (mtime, entries) from the last walk and this one
+        self.listings = {}
+        self.listed = {}
+
+    def entries(self, folder):
+        """List a folder, reusing the last listing if it hasn't changed"""
+        mtime = os.stat(folder).st_mtime
+        listing = self.listings.get(folder)
+        if listing is None or listing[0] != mtime:
+            listing = (mtime, Discovery.entries(self, folder))
+        self.listed[folder] = listing
+        return listing[1]
+
+    def forget(self):
+        """Keep only the listings of the folders seen since the last call"""
+        self.listings = self.listed
+        self.listed = {}
+
+def filesystem(path):
+    """The type of the file system a path is on (None if it can't be found)"""
+    path = os.path.realpath(path)
+    found = (None, None)
+    try:
+        fh = open('/proc/mounts')
+        mounts = [ line.split() for line in fh ]
+        fh.close()
+    except IOError:
+        return None
+
+    for mount in mounts:
+        if len(mount) < 3:
+            continue
+        point = mount[1].replace('\\040', ' ')
+        if (path == point or path.startswith(point.rstrip('/') + '/')) and len(point) > len(found[0] or ''):
+            found = (point, mount[2])
+    return found[1]
@@ -0,0 +1,229 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import json
+import gzip
+import os.path
+import re
+import struct
+import tempfile
+
+class WordCoordinates:
+    """Write the word coordinates of a page
+
+    Two encodings are available. 'dict' is the original structure:
+
+      { 'page': { 'width', 'height' }, 'words': { word: [ { 'left', 'right', 'top', 'bottom' } ] } }
+
+    'compact' is a word list with the number of occurrences of each word and a
+    single flat array of the integer coordinates (left, right, top, bottom) of
+    every occurrence, in word order:
+
+      { 'format': 'compact', 'page': { 'width', 'height' }, 'words': [ word ],
+        'counts': [ n ], 'coords': [ l, r, t, b, l, r, t, b, ... ] }
+
+    Either can be gzip'd. Use read_words to get the original structure back from
+    any of them.
+    """
+    def __init__(self, format='dict', compress=False):
+        self.format = format
+        self.compress = compress
+
+    def filename(self, basename):
+        """The name of the words file for a page"""
+        return "%s.json.gz" % basename if self.compress else "%s.json" % basename
+
+    def write(self, path, words):
+        """Write the word coordinates of a page to path"""
+        data = None
+        if self.format == 'compact' and words is not None:
+            data = encode(words)
+        if data is None:
+            data = json.dumps(words)
+
+        if self.compress:
+            fh = gzip.open(path, 'wb')
+        else:
+            fh = open(path, 'w')
+        fh.write(data)
+        fh.close()
+
+class WordIndex:
+    """An index of the words on all of an item's pages
+
+    index.json maps each normalised word (lower case, without leading or trailing
+    punctuation) to the pages it's on, with the offset (in bytes) and number of
+    its occurrences in coords.bin:
+
+      { 'format': 'word-index', 'coords': 'coords.bin', 'pages': { page: { 'width', 'height' } },
+        'words': { word: [ [ page, offset, count ] ] } }
+
+    coords.bin holds the coordinates of each occurrence as four little endian 32
+    bit integers (left, right, top, bottom), grouped by word and then page. So a
+    viewer can find the pages a word is on with one request and get where it is
+    on them with one range request.
+
+    Each page's coordinates are packed into a temporary file as the page is
+    added, so only the offsets are kept in memory until the index is written.
+    """
+    def __init__(self):
+        # page -> its dimensions
+        self.pages = {}
+
+        # word -> page -> [ (offset in the spill file, number of occurrences) ]
+        self.index = {}
+        self.spill = None
+
+    def add(self, page, words):
+        """Add the word coordinates of a page"""
+        if words is None:
+            return
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile()
+
+        self.pages[page] = words['page']
+        for word, occurrences in words['words'].items():
+            key = normalise(word)
+            if not key:
+                continue
+
+            # occurrences without a full set of coordinates can't be highlighted
+            coords = []
+            for c in occurrences:
+                try:
+                    coords.append([ coordinate(c[k]) for k in ('left', 'right', 'top', 'bottom') ])
+                except (KeyError, TypeError, ValueError):
+                    continue
+            if not coords:
+                continue
+
+            data = struct.pack('<%di' % (len(coords) * 4), *[ v for c in coords for v in c ])
+            self.index.setdefault(key, {}).setdefault(page, []).append((self.spill.tell(), len(coords)))
+            self.spill.write(data)
+
+    def write(self, folder):
+        """Write index.json and coords.bin to folder; returns the files written"""
+        coords_file = os.path.join(folder, 'coords.bin')
+        fh = open(coords_file, 'wb')
+        offset = 0
+        words = {}
+        for key in sorted(self.index):
+            words[key] = []
+            for page in sorted(self.index[key], key=page_order):
+                count = 0
+                for spilled, n in self.index[key][page]:
+                    self.spill.seek(spilled)
+                    fh.write(self.spill.read(n * 16))
+                    count += n
+                words[key].append([ page, offset, count ])
+                offset += count * 16
+        fh.close()
+        self.spill.close()
+        self.spill = None
+
+        index_file = os.path.join(folder, 'index.json')
+        fh = open(index_file, 'w')
+        fh.write(json.dumps({ 'format': 'word-index', 'coords': 'coords.bin', 'pages': self.pages, 'words': words },
+            separators=(',', ':')))
+        fh.close()
+        return [ index_file, coords_file ]
+
+    def remove(self, folder):
+        """Remove an earlier index from folder (eg. when the OCR has gone); returns the files removed"""
+        removed = []
+        for name in [ 'index.json', 'coords.bin' ]:
+            path = os.path.join(folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+        return removed
+
+def normalise(word):
+    """The form of a word used in the word index"""
+    return re.sub(r'^\W+|\W+$', '', word, flags=re.UNICODE).lower()
+
+def page_order(page):
+    """The sort key of a page number (numerically, where it's a number)"""
+    return (0, int(page), page) if page.isdigit() else (1, 0, page)
+
+def coordinate(value):
+    """A coordinate as an integer (rounded if need be)"""
+    return int(round(float(value)))
+
+def encode(words):
+    """Return the compact encoding of a page's word coordinates
+
+    Returns None if the coordinates aren't all integers (in which case the dict
+    encoding should be used).
+    """
+    try:
+        page = dict([ (k, to_int(v)) for k, v in words['page'].items() ])
+        word_list = words['words'].keys()
+        counts = []
+        coords = []
+        for w in word_list:
+            counts.append(len(words['words'][w]))
+            for c in words['words'][w]:
+                coords += [ to_int(c['left']), to_int(c['right']), to_int(c['top']), to_int(c['bottom']) ]
+    except (ValueError, TypeError):
+        return None
+    return json.dumps({ 'format': 'compact', 'page': page, 'words': word_list, 'counts': counts, 'coords': coords },
+        separators=(',', ':'))
+
+def to_int(value):
+    """The integer value of a coordinate; only if it converts back to the same string"""
+    i = int(value)
+    if str(i) != value:
+        raise ValueError(value)
+    return i
+
+def decode(data):
+    """Return the original structure from the (parsed) compact encoding"""
+    page = dict([ (k, str(v)) for k, v in data['page'].items() ])
+    words = {}
+    coords = data['coords']
+    offset = 0
+    for w, n in zip(data['words'], data['counts']):
+        words[w] = [ { 'left': str(coords[i]), 'right': str(coords[i + 1]), 'top': str(coords[i + 2]), 'bottom': str(coords[i + 3]) }
+            for i in range(offset, offset + n * 4, 4) ]
+        offset += n * 4
+    return { 'page': page, 'words': words }
+
+def read_words(path):
+    """Read a words file in any of the encodings and return the original structure"""
+    fh = open(path, 'rb')
+    data = fh.read()
+    fh.close()
+
+    # gzip'd?
+    if data[:2] == '\x1f\x8b':
+        fh = gzip.open(path, 'rb')
+        data = fh.read()
+        fh.close()
+
+    data = json.loads(data)
+    if isinstance(data, dict) and data.get('format') == 'compact':
+        return decode(data)
+    return data
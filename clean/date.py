@@ -22,20 +22,36 @@
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import re
+from collections import OrderedDict
 from datetime import datetime
 
+# time formats we will try to clean, in order. Each has a pattern which matches
+#  (at least) every string strptime would accept for that format so the format
+#  can be picked without trying them all.
+timeformats = [
+    ("%Y-%m-%d", r"\d{4}-\d{1,2}- ?\d{1,2}"),       # 1976-01-01
+    ("%Y %m %d", r"\d{4}\s+\d{1,2}\s+ ?\d{1,2}"),   # 1976 01 01
+    ("%d %B %Y", r" ?\d{1,2}\s+[a-z]+\s+\d{4}"),    # 12 January 1997
+    ("%B %Y",    r"[a-z]+\s+\d{4}"),                # February 1998
+    ("%Y",       r"\d{4}"),                         # 2004
+    ("c. %Y",    r"c\.\s+\d{4}"),                   # c. 2004
+    ("%Y?",      r"\d{4}\?"),                       # 2004?
+]
+
+# strptime matches case insensitively and the whole string must be consumed
+dispatch = re.compile(r"(?:%s)\Z" % "|".join([ "(?P<f%s>%s)" % (i, p) for i, (f, p) in enumerate(timeformats) ]),
+    re.IGNORECASE)
+patterns = [ re.compile(r"(?:%s)\Z" % p, re.IGNORECASE) for f, p in timeformats ]
+
 class date_cleanser:
-    def __init__(self):
+    def __init__(self, cache_size=4096):
         # time formats we will try to clean
-        self.timeformats = [
-            "%Y-%m-%d", # 1976-01-01
-            "%Y %m %d", # 1976 01 01
-            "%d %B %Y", # 12 January 1997
-            "%B %Y",    # February 1998
-            "%Y",       # 2004
-            "c. %Y",    # c. 2004
-            "%Y?",      # 2004?
-        ]
+        self.timeformats = [ f for f, p in timeformats ]
+
+        # the most recently cleaned values: raw -> clean
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
 
         # the list of date fields in use
         #self.date_fields = date_fields
@@ -48,15 +64,38 @@ class date_cleanser:
         @params:
         date: the date string we want to standardise
         """
-        #  handle whatever it is we find...
-        for timeformat in self.timeformats:
-            try:
-                datevalue = datetime.strptime(datevalue, timeformat)
-                datevalue = "%sZ" % str(datevalue).replace(' ', 'T')
-                break
-            except:
-                pass
-                # ie try the next format until we succeed, or get to the end of the list
+        try:
+            cleaned = self.cache.pop(datevalue)
+        except KeyError:
+            cleaned = self.convert(datevalue)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[datevalue] = cleaned
+        return cleaned
+
+    def clean_all(self, datevalues):
+        """Clean a list of date strings
+
+        @params:
+        datevalues: the date strings we want to standardise
+        """
+        return [ self.clean(d) for d in datevalues ]
+
+    def convert(self, datevalue):
+        """Convert a date string to Solr date format (or None)"""
+        m = dispatch.match(datevalue)
+        if m is not None:
+            # try the format whose pattern matched and, should strptime not
+            #  agree, any later ones that match
+            first = int(m.lastgroup[1:])
+            for i in range(first, len(timeformats)):
+                if i > first and patterns[i].match(datevalue) is None:
+                    continue
+                try:
+                    converted = datetime.strptime(datevalue, timeformats[i][0])
+                    return "%sZ" % str(converted).replace(' ', 'T')
+                except ValueError:
+                    pass
 
         # here we check that we can read the datevalue using
         #  the expected format. If there wasn't a suitable format in the list,
@@ -68,5 +107,3 @@ class date_cleanser:
         except ValueError:
             #log.warn("Unknown time format: %s" % datevalue)
             return None
-
-
@@ -23,6 +23,10 @@
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import lxml.html.clean
+
+# one configured cleaner for every value
+cleaner = lxml.html.clean.Cleaner(style=True, remove_tags = [ 'p' ])
+
 class markup_cleanser:
     def __init__(self):
         pass
@@ -30,14 +34,22 @@ class markup_cleanser:
     def clean(self, field):
         """Some fields get populated with HTML markup
 
-        Here we get lxml to strip all markup for us.
+        Here we get lxml to strip all markup for us. Text without any
+        markup is returned as is.
         @params:
         field: the field to clean
         """
+        if '<' not in field:
+            return field
 
-        c = lxml.html.clean.Cleaner(style=True, remove_tags = [ 'p' ])
         try:
-            return c.clean_html(field).lstrip('<div>').rstrip('</div>')
+            field = cleaner.clean_html(field)
         except:
             return field
 
+        # lxml wraps the cleaned fragment in a div
+        if field.startswith('<div>'):
+            field = field[len('<div>'):]
+        if field.endswith('</div>'):
+            field = field[:-len('</div>')]
+        return field
@@ -0,0 +1,68 @@
+# Copyright (c) 2013, Deakin University
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without 
+#  modification, are permitted provided that the following conditions are met:
+#
+# - Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# - Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+#  AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+#  IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+#  ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+#  LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+#  CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+#  SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+#  INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+#  CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+class field_pipeline:
+    """Clean the fields of a document in a single pass
+
+    Cleaners are registered against field names. Each element of the document is
+    visited once and its text is handed to the cleaners registered for its name,
+    in the order they were registered. Fields left empty are then removed.
+    """
+    def __init__(self, strip_empty=True):
+        self.cleaners = {}
+        self.strip_empty = strip_empty
+
+    def register(self, field_names, cleaner):
+        """Register a cleaner for a set of fields
+
+        @params:
+        field_names: the names of the fields to clean
+        cleaner: a callable which takes the field text and returns the cleaned text (or None)
+        """
+        for name in field_names:
+            self.cleaners.setdefault(name, []).append(cleaner)
+
+    def clean(self, doc):
+        """Clean the document in place
+
+        @params:
+        doc: the XML document
+        """
+        empty = []
+        for e in doc.iter():
+            cleaners = self.cleaners.get(e.get('name'))
+            if cleaners is not None:
+                for cleaner in cleaners:
+                    # have we found an empty or missing field ?
+                    if e.text is None:
+                        break
+                    e.text = cleaner(e.text)
+
+            # Solr date fields don't like to be empty
+            if self.strip_empty and e.tag == 'field' and e.text is None:
+                empty.append(e)
+
+        for e in empty:
+            e.getparent().remove(e)
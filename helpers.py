@@ -7,6 +7,7 @@ from lxml import etree, html
 from clean.empty import elements
 from clean.date import date_cleanser
 from clean.markup import markup_cleanser
+from clean.pipeline import field_pipeline
 import requests
 from datetime import datetime, timedelta
 
@@ -14,8 +15,28 @@ from datetime import datetime, timedelta
 # the names of the fields which could have a date
 date_fields = [ 'date_from', 'date_to', 'date_created', 'chapter_book_year', 'journal_year', 'reviewed_book_year' ]
 
+# one cleanser (and so one cache of cleaned values) for every document
+dates = date_cleanser()
+
 # the names of the fields which could have markup
 markup_fields = [ 'abstract', 'text', 'locality' ]
+markup = markup_cleanser()
+
+# dates, markup and empty fields cleaned in one pass over the document
+pipeline = field_pipeline()
+pipeline.register(date_fields, dates.clean)
+pipeline.register(markup_fields, markup.clean)
+
+def clean_document(doc):
+    """Clean the dates and markup and remove the empty fields of a document
+
+    Does the work of clean_dates, clean_markup and strip_empty_elements
+    in a single pass over the document.
+
+    @params:
+    doc: the XML document
+    """
+    pipeline.clean(doc)
 
 def clean_dates(doc):
     """Date data needs to be in Solr date format
@@ -25,14 +46,10 @@ def clean_dates(doc):
     @params:
     doc: the XML document
     """
-    date_elements = [ e for e in doc.iter() if e.get('name') in date_fields ]
-    for e in date_elements:
-        # have we found an empty or missing date field ?
-        if e.text is None:
-            continue
-
-        dc = date_cleanser()
-        datevalue = dc.clean(e.text)
+    # have we found an empty or missing date field ?
+    date_elements = [ e for e in doc.iter() if e.get('name') in date_fields and e.text is not None ]
+    datevalues = dates.clean_all([ e.text for e in date_elements ])
+    for e, datevalue in zip(date_elements, datevalues):
         e.text = datevalue
 
 def clean_markup(doc):
@@ -47,7 +64,7 @@ def clean_markup(doc):
         if e.text is None:
             continue
 
-        e.text = markup_cleanser().clean(e.text)
+        e.text = markup.clean(e.text)
 
 
 
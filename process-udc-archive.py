@@ -7,332 +7,21 @@ from lxml import etree
 import os
 import os.path
 import sys
-from fnmatch import fnmatch
-import subprocess
-import copy
-import shlex
 import json
-import string
+import signal
 
 # get the logger
 import logging
 log = logging.getLogger(__name__)
 
 from Index import *
-
-class Crawler:
-    def __init__(self, input_folder, n, output_folder, transforms, url_base):
-        self.input_folder = input_folder
-        if n is not None:
-            self.stop_after = int(n)
-        else:
-            self.stop_after = n
-        self.output_folder = output_folder
-        self.transforms = transforms
-        self.url_base = url_base
-
-    def run(self):
-        # walk the path looking for XML files matching the bib code
-        count = 0
-        for (dirpath, dirnames, filenames) in os.walk(self.input_folder):
-            for f in filenames:
-                if fnmatch(f, '*-item.xml'):
-                    count += 1
-                    # looks like a folder we want to process
-
-                    datafiles = {}
-                    datafiles['dirpath'] = dirpath
-                    datafiles['metadata_files'] = []
-                    datafiles['metadata_files'].append(os.path.join(dirpath, f))
-
-                    bibrecid = f.split('-')[0]
-                    item = f.split('-')[1]
-                    log.info("Processing: %s: %s-%s" % (count, bibrecid, item))
-
-                    for f in filenames:
-                        if fnmatch(f, '*-cat.xml'):
-                            datafiles['metadata_files'].append(os.path.join(dirpath, f))
-
-                        #elif fnmatch(f, '*-exiftool.txt'):
-                        #    datafiles['metadata_files'].append(os.path.join(dirpath, f))
-
-                        elif fnmatch(f, '*.pdf'):
-                            datafiles['pdf_data_file'] = f
-
-
-                    log.debug(datafiles);
-
-                    # setup 
-                    output_folder = self.setup(bibrecid, item)
-
-                    # get the metadata
-                    metadata = self.get_metadata(datafiles['metadata_files'], bibrecid, item)
-                    if metadata == None:
-                        log.error("Metadata file invalid. Not continuing.")
-                        if (self.stop_after == count):
-                            sys.exit()
-                        continue
-
-                    # process any images
-                    image_paths = [ os.path.join(datafiles['dirpath'], d) for d in [ 'TIFF', 'TIF', 'tiff', 'tif' ] ]
-                    found_images = False;
-                    for path in image_paths:
-                        if os.path.exists(path):
-                            found_images = True;
-                            self.process_images(path, output_folder)
-
-                            # create a solr record for each image found
-                            url_base = os.path.join(self.url_base, bibrecid, item)
-                            self.create_solr_stub_records(output_folder, metadata, url_base)
-
-                            self.process_ocr_data(os.path.join(datafiles['dirpath'], 'OCR'), output_folder)
-                            break
-                    
-                    if not found_images:
-                        log.error("No images found! %s, %s" % (bibrecid, item))
-
-                    if self.stop_after is not None and self.stop_after == count:
-                        sys.exit()
-
-                    log.info("")
-
-    def setup(self, bibrecid, item):
-        """Setup the required output folder structure"""
-        log.info('Setting up the required folder structure')
-        output_folder = os.path.join(self.output_folder, bibrecid, item) 
-        if not os.path.exists(output_folder):
-            log.debug("Creating: %s" % output_folder)
-            os.makedirs(output_folder)
- 
-        solr = os.path.join(output_folder, 'solr')
-        if not os.path.exists(solr):
-            log.debug("Creating: %s" % solr)
-            os.makedirs(solr)
-
-        words = os.path.join(output_folder, 'words')
-        if not os.path.exists(words):
-            log.debug("Creating: %s" % words)
-            os.makedirs(words)
-
-        return output_folder
-
-    def get_metadata(self, metadata_files, bibrecid, item):
-        """Extract the item metadata and return it as an lxml document"""
-        log.debug('Extracting the item metadata')
-
-        for m in metadata_files:
-            if fnmatch(m, '*-item.xml'):
-                transform = os.path.join(self.transforms, 'udc-item.xsl')
-                d = self.process_document(m, transform)
-                if d == None:
-                    log.error("Couldn't get any metadata from: %s" % m)
-                    return
-                d = self.add_field(d, 'bibrecid', bibrecid)
-                d = self.add_field(d, 'item', item)
-                d = self.add_field(d, 'group', "%s-%s" % (bibrecid, item))
-
-            #elif fnmatch(m, '*-cat.xml'):
-            #    transform = os.path.join(self.transforms, 'udc-cat.xsl')
-            #    e = self.process_document(m, transform)
-
-        log.debug("Metadata\n%s" % etree.tostring(d, pretty_print=True))
-        return d 
-
-    def process_document(self, d, transform):
-        try:
-            log.debug("Reading in XSL transform to process metadata_file: %s" % transform)
-            xsl = etree.parse(transform)
-            xsl.xinclude()
-            xsl = etree.XSLT(xsl)
-        except IOError:
-            log.error("No such transform: %s" % transform)
-            return
-        except etree.XSLTParseError:
-            log.error("Check the stylesheet; I can't parse it! %s" % transform)
-            return
-
-        # read in the metadata file 
-        log.debug("Reading in the metadata file: %s" % d)
-        try:
-            tree = etree.parse(d)
-        except etree.XMLSyntaxError:
-            log.error("Invalid metadata file: %s" % d)
-            return
-
-        # transform it!
-        log.debug("Transforming the document")
-        d = xsl(tree)
-        return d
-
-    def add_field(self, doc, field_name, field_value):
-        tmp = doc.xpath('/add/doc')[0]
-
-        # add the record and item metadata 
-        b = etree.Element('field', name=field_name)
-        b.text = field_value
-        tmp.append(b)
-
-        add = etree.Element('add')
-        add.append(tmp)
-        return add
-
-    def process_images(self, path, output_folder):
-        log.info('Processing the image set')
-        output_folder = os.path.join(output_folder, 'jpg')
-        if not os.path.exists(output_folder):
-            log.debug("Creating: %s" % output_folder)
-            os.makedirs(output_folder)
-
-        large_images = os.path.join(output_folder, 'large')
-        if not os.path.exists(large_images):
-            log.debug("Creating: %s" % large_images)
-            os.makedirs(large_images)
-
-        thumb_images = os.path.join(output_folder, 'thumb')
-        if not os.path.exists(thumb_images):
-            log.debug("Creating: %s" % thumb_images)
-            os.makedirs(thumb_images)
-
-        for f in os.listdir(path):
-            # have we already converted this file - skip it if we have
-            file_basename = os.path.basename(f).split('.')[0]
-
-            # file fully qualified path
-            file_full_path = os.path.join(path, f)
-
-            # only handle image files in the specified format 
-            extension = os.path.splitext(f)[1]
-            if extension in [ '.tif', '.jp2' ]:
-
-                large_file = os.path.join(large_images, "%s.jpg" % file_basename)
-                thumb_file = os.path.join(thumb_images, "%s.jpg" % file_basename)
-                 
-                # if we don't have a large image - create it
-                if not os.path.exists(large_file) or os.stat(large_file).st_size == 0:
-                    log.debug("Creating jpeg for %s" % file_full_path)
-                    large_file = "%s/%s.jpg" % (large_images, file_basename)
-                    cmd = "convert %s -resample 200 -strip -resize '3000x3000>' -compress JPEG -quality 30 -depth 8 -unsharp '1.5x1+0.7+0.02' %s" % (file_full_path, large_file)
-                    try:
-                        p = subprocess.check_call(cmd, stderr=subprocess.PIPE, shell=True)
-                    except:
-                        log.error("Error creating large jpeg")
-                        log.error("%s" % cmd)
-                    #print ['convert', file_full_path, "%s/%s.jpg" % (large_images, file_basename) ]
-
-                # if we don't have a thumbnail - create it
-                if not os.path.exists(thumb_file) or os.stat(large_file).st_size == 0:
-                    log.debug("Creating thumbnail for %s" % file_full_path)
-                    cmd = "convert %s -thumbnail 100x200 -strip -depth 8 %s/%s.jpg" % (large_file, thumb_images, file_basename)
-                    try:
-                        p = subprocess.check_call(cmd, stderr=subprocess.PIPE, shell=True)
-                    except:
-                        log.error("Error creating thumbnail")
-                        log.error("%s" % cmd)
-
-                continue
-                
-    def create_solr_stub_records(self, output_folder, d, url_base):
-        log.info('Creating the SOLR stub records')
-        images = os.path.join(output_folder, 'jpg', 'large')
-        solr = os.path.join(output_folder, 'solr')
-
-        files = os.listdir(images)
-        total_pages = str(len(files))
-
-        for f in files:
-            basename = os.path.splitext(os.path.basename(f))[0]
-
-            rid = os.path.join(url_base, 'solr', basename)
-            large_image = os.path.join(url_base, 'jpg/large', "%s.jpg" % basename)
-            thumb_image = os.path.join(url_base, 'jpg/thumb', "%s.jpg" % basename)
-            words = os.path.join(url_base, 'words', "%s.json" % basename)
-            
-            doc = self.add_field(copy.deepcopy(d), 'id', "%s.xml" % rid)
-            doc = self.add_field(doc, 'page', basename.split('-')[2])
-            doc = self.add_field(doc, 'large_image', large_image)
-            doc = self.add_field(doc, 'thumb_image', thumb_image)
-            doc = self.add_field(doc, 'total_pages', total_pages)
-            doc = self.add_field(doc, 'words', words)
-
-            fh = os.path.join(solr, "%s.xml" % basename)
-            log.debug("Writing metatdata to: %s " % fh)
-            f = open(fh, 'w')
-            f.write(etree.tostring(doc, pretty_print=True))
-            f.close()
-
-    def process_ocr_data(self, ocr_data, output_folder):
-        log.info('Processing the OCR data')
-
-        # walk the tree of output images
-        for f in os.listdir(os.path.join(output_folder, 'jpg/large')):
-            name = os.path.basename(f).split('.jpg')[0]
-            ocr_data_file = os.path.join(ocr_data, "%s.xml" % name)
-            solr_stub = os.path.join(output_folder, 'solr', "%s.xml" % name)
-            words_file = os.path.join(output_folder, 'words', "%s.json" % name)
-            if not os.path.exists(ocr_data_file):
-                continue
-
-            # parse that file as it should have metadata in it
-            tree = etree.parse(solr_stub)
-            #print etree.tostring(tree)
-            #print etree.tostring(element, pretty_print=True)
-            log.debug("Writing OCR data to: %s" % solr_stub)
-            text = self.get_ocr_text(ocr_data_file)
-            tree = self.add_field(tree, 'text', text)
-
-            fh = open(solr_stub, 'w')
-            fh.write(etree.tostring(tree, pretty_print=True, method='xml'))
-            fh.close()
-                
-            # write out the word coords json file
-            words = self.get_ocr_words(ocr_data_file)
-            fh = open(words_file, 'w')
-            fh.write(json.dumps(words))
-            fh.close()
-
-        # for each: source the OCR - load it and extract text content
-        # source the solr stub file - inject the text content
-
-    def get_ocr_text(self, ocr_data_file):
-        try:
-            for event, element in etree.iterparse(ocr_data_file,
-                tag = '{http://www.scansoft.com/omnipage/xml/ssdoc-schema3.xsd}page'):
-
-                # construct the solr source filename
-                source = element.xpath('n:body/n:section', namespaces = { 'n': 'http://www.scansoft.com/omnipage/xml/ssdoc-schema3.xsd' })[0]
-                return " ".join(etree.tostring(element, method='text', encoding='unicode').split())
-        except:
-            pass
-
-    def get_ocr_words(self, ocr_data_file):
-        try:
-            tree = etree.parse(ocr_data_file)
-        except:
-            log.error("Couldn't parse: %s" % ocr_data_file)
-            print sys.exc_info()
-            return
-
-        # get page dimensions
-        for p in tree.xpath('//n:theoreticalPage', namespaces = { 'n': 'http://www.scansoft.com/omnipage/xml/ssdoc-schema3.xsd' }):
-            page_dimensions = {}
-            page_dimensions['width'] = p.attrib['width']
-            page_dimensions['height'] = p.attrib['height']
-
-        words = {}
-        for p in tree.xpath('//n:wd', namespaces = { 'n': 'http://www.scansoft.com/omnipage/xml/ssdoc-schema3.xsd' }):
-            word_list = words.get(p.text)
-            coords = { 'left': p.attrib['l'], 'right': p.attrib['r'], 'top': p.attrib['t'], 'bottom': p.attrib['b'] }
-
-            try:
-                w = p.text.rstrip(string.punctuation)
-                if word_list is None:
-                    words[w] = [coords]
-                else:
-                    word_list.append(coords)
-                    words[w] = word_list
-            except:
-                pass
-        return { 'page': page_dimensions, 'words': words }
+from Crawler import *
+from Manifest import *
+from WordCoordinates import *
+from Stats import *
+from Poster import *
+from Ledger import *
+from Watcher import *
 
 if __name__ == "__main__":
     
@@ -343,11 +32,86 @@ if __name__ == "__main__":
     parser.add_argument('--input',   dest='input', required=True, help='The path to the input data.')
     parser.add_argument('--output',   dest='output', help='The path to where the output should go.')
     parser.add_argument('--n', dest='n', default=None, help="Stop after processing this many items.")
+    parser.add_argument('--items-from', dest='items_from', default=None,
+        help='Process the items listed in this file (item folders or *-item.xml files, one per line) instead of walking the input.')
+    parser.add_argument('--shard', dest='shard', default=None,
+        help='Only process shard i of N (eg. 2/3) of the items; each item is in exactly one shard.')
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+        help='The number of processes to use when crawling. Default: 1')
+    parser.add_argument('--engine', dest='engine', choices=[ 'pillow', 'convert' ], default='pillow',
+        help='Create the jpegs in process with Pillow or with ImageMagick\'s convert. Default: pillow')
+
+    parser.add_argument('--tiles', dest='tiles', action='store_true', default=False,
+        help='Also create a deep zoom tile pyramid of each page (needs Pillow).')
+    parser.add_argument('--words-format', dest='words_format', choices=[ 'dict', 'compact' ], default='dict',
+        help='How to encode the word coordinates: dict (the original structure) or compact. Default: dict')
+    parser.add_argument('--words-gzip', dest='words_gzip', action='store_true', default=False,
+        help='Gzip the word coordinates files (written as .json.gz).')
+    parser.add_argument('--manifest', dest='manifest', default=None,
+        help='Keep a record of the items processed in this file and skip those that haven\'t changed.')
+    parser.add_argument('--manifest-hashes', dest='manifest_hashes', action='store_true', default=False,
+        help='Include the content hashes of the input files in the manifest (slower; catches more changes).')
+
+    parser.add_argument('--changes', dest='changes', default=None,
+        help='List the output files created, rewritten or removed by the crawl in this file (see tools/replicate).')
+    parser.add_argument('--prune', dest='prune', action='store_true', default=False,
+        help='With --manifest, remove the output of the items which have disappeared from the input.')
 
     parser.add_argument('--crawl', dest='crawl', action='store_true', default=None,
         help='Only perform the crawl and transform stages.')
     parser.add_argument('--post', dest='post', action='store_true', default=None,
-        help='Only perform the post stage (includes index clean).')
+        help='Only perform the post stage.')
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False,
+        help='Crawl and post in one pass: documents are sent to solr as they are created.')
+    parser.add_argument('--watch', dest='watch', action='store_true', default=False,
+        help='Keep running, crawling and posting items as they are added or changed (like --pipeline).')
+    parser.add_argument('--watch-interval', dest='watch_interval', type=int, default=60,
+        help='With --watch, how often (in seconds) to scan the input when inotify isn\'t used. Default: 60')
+    parser.add_argument('--watch-deep-interval', dest='watch_deep_interval', type=int, default=3600,
+        help='With --watch, how often (in seconds) a scan also checks every page file for changes made in place. Default: 3600')
+    parser.add_argument('--watch-poll', dest='watch_poll', action='store_true', default=False,
+        help='With --watch, always scan the input rather than using inotify.')
+    parser.add_argument('--settle', dest='settle', type=int, default=30,
+        help='With --watch, how long (in seconds) an item must be left alone before it is processed. Default: 30')
+    parser.add_argument('--no-stubs', dest='no_stubs', action='store_true', default=False,
+        help='With --pipeline, don\'t write the solr stub files.')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=500,
+        help='The maximum number of documents to send to solr in one request. Default: 500')
+    parser.add_argument('--batch-bytes', dest='batch_bytes', type=int, default=5242880,
+        help='The maximum size (in bytes) of a request to solr. Default: 5MB')
+    parser.add_argument('--commit-within', dest='commit_within', type=int, default=None,
+        help='Ask solr to commit the documents within this many milliseconds instead of a final commit.')
+    parser.add_argument('--rebuild', dest='rebuild', action='store_true', default=False,
+        help='Rebuild the whole index in the staging core then swap it with the live one (with --post or --pipeline).')
+    parser.add_argument('--staging-core', dest='staging_core', default=None,
+        help='The core to rebuild the index in. Default: staging_core from the config file')
+    parser.add_argument('--optimize', dest='optimize', action='store_true', default=False,
+        help='Optimize the index once the post stage is complete.')
+    parser.add_argument('--stream-items', dest='stream_items', action='store_true', default=False,
+        help='Send the page documents of each item in one streamed (chunked) request instead of in batches.')
+    parser.add_argument('--senders', dest='senders', type=int, default=2,
+        help='The number of concurrent requests to make to solr. Default: 2')
+    parser.add_argument('--readers', dest='readers', type=int, default=2,
+        help='The number of threads reading the solr stubs ahead of the post. Default: 2')
+    parser.add_argument('--validate', dest='validate', action='store_true', default=False,
+        help='Check each solr stub is well formed XML before posting it.')
+    parser.add_argument('--ledger', dest='ledger', default=None,
+        help='Keep a record of the solr stubs solr has accepted in this file and only post those that have changed.')
+    parser.add_argument('--full', dest='full', action='store_true', default=False,
+        help='With --ledger, post every solr stub whether it has changed or not.')
+    parser.add_argument('--retries', dest='retries', type=int, default=3,
+        help='How many times to retry a request that failed with a server or connection error. Default: 3')
+    parser.add_argument('--timeout', dest='timeout', type=int, default=600,
+        help='How long (in seconds) to wait for solr to respond before the request is retried. Default: 600')
+    parser.add_argument('--dead-letter', dest='dead_letter', default=None,
+        help='Write documents that could not be submitted to this file so they can be replayed. Default: (output).dead-letter')
+    parser.add_argument('--replay', dest='replay', default=None,
+        help='Resubmit the documents saved in this dead letter file.')
+
+    parser.add_argument('--stats', dest='stats', default=None,
+        help='Write a JSON summary of the time spent in each stage and what was done to this file.')
+    parser.add_argument('--profile', dest='profile', default=None,
+        help='Profile each stage with cProfile and write the statistics to this folder.')
 
     parser.add_argument('--info', dest='info', action='store_true', help='Turn on informational messages')
     parser.add_argument('--debug', dest='debug', action='store_true', help='Turn on full debugging (includes --info)')
@@ -376,6 +140,7 @@ if __name__ == "__main__":
     transforms = cfg.get('General', 'transforms') if (cfg.has_section('General') and cfg.has_option('General', 'transforms')) else None
     url_base = cfg.get('General', 'url_base') if (cfg.has_section('General') and cfg.has_option('General', 'url_base')) else None
     solr = cfg.get('General', 'solr') if (cfg.has_section('General') and cfg.has_option('General', 'solr')) else None
+    staging_core = cfg.get('General', 'staging_core') if (cfg.has_section('General') and cfg.has_option('General', 'staging_core')) else None
     log.debug("Processing: '%s'. Output: '%s'. Solr: '%s'" % (args.input, args.output, solr))
  
     # check the arguments
@@ -383,33 +148,153 @@ if __name__ == "__main__":
         log.error("Does %s exist?" % args.input)
         sys.exit()
 
+    if args.items_from is not None and not os.path.exists(args.items_from):
+        log.error("Can't find that items file: %s" % args.items_from)
+        sys.exit()
+
+    shard = None
+    if args.shard is not None:
+        try:
+            shard = tuple([ int(x) for x in args.shard.split('/') ])
+        except ValueError:
+            shard = None
+        if shard is None or len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+            log.error("The shard should be given as i/N where i is between 1 and N: %s" % args.shard)
+            sys.exit()
+
     if args.output is not None and not os.path.exists(args.output):
         os.mkdir(args.output)
 
-    if args.crawl is not None:
+    if args.watch:
+        # watching is a pipeline that doesn't end
+        if args.rebuild:
+            log.error("Can't rebuild the index while watching")
+            sys.exit()
+        args.pipeline = True
+
+    commit_within = args.commit_within
+    if args.rebuild:
+        # build the index from scratch in the staging core and swap it with
+        #  the live one when it's done
+        staging_core = args.staging_core or staging_core
+        if staging_core is None:
+            log.error("A rebuild needs a staging core: set staging_core in the config or use --staging-core")
+            sys.exit()
+        if args.post is None and not args.pipeline:
+            log.error("A rebuild is done by the post stage: use --post or --pipeline")
+            sys.exit()
+        if args.pipeline and args.manifest is not None:
+            log.error("A pipeline rebuild needs every item to be crawled: don't use --manifest")
+            sys.exit()
+        if args.shard is not None or args.items_from is not None or args.n is not None:
+            log.error("A rebuild replaces the whole index: don't use --shard, --items-from or --n")
+            sys.exit()
+
+        live_core = solr.rstrip('/').rsplit('/', 1)[1]
+        solr = "%s/%s" % (solr.rstrip('/').rsplit('/', 1)[0], staging_core)
+        commit_within = None
+        log.info("Rebuilding the index in %s" % solr)
+
+    if args.profile is not None and not os.path.exists(args.profile):
+        os.makedirs(args.profile)
+    stats = Stats(args.profile)
+
+    manifest = None
+    if args.manifest is not None:
+        manifest = Manifest(args.manifest, args.manifest_hashes)
+
+    if args.post is not None or args.replay is not None or args.pipeline:
+        # the pipeline posts while it crawls so it needs at least one sender
+        senders = max(args.senders, 1) if args.pipeline else args.senders
+        # failed documents are kept alongside the output unless we're told otherwise
+        dead_letter = args.dead_letter
+        if dead_letter is None and args.output is not None:
+            dead_letter = "%s.dead-letter" % os.path.normpath(args.output)
+        i = Index(solr, args.batch_size, args.batch_bytes, commit_within,
+            senders, args.retries, dead_letter=dead_letter, stats=stats, timeout=args.timeout)
+
+    if args.rebuild:
+        i.clean()
+
+    if args.replay is not None:
+        i.replay(args.replay)
+        if args.post is None and not args.pipeline:
+            i.commit()
+            i.close()
+
+    if args.crawl is not None or args.pipeline:
         ### CRAWLER
-        crawler = Crawler(args.input, args.n, args.output, transforms, url_base)
-        crawler.run()
-
-    if args.post is not None:
-        log.info("Posting the data in: %s" % args.input)
-        i = Index(solr)
-
-        # walk the path looking for the solr folder
-        count = 0
-        for (dirpath, dirnames, filenames) in os.walk(args.input):
-            if os.path.basename(dirpath) == 'solr':
-                count += 1
-                log.info("Processing: %s: %s" % (count, dirpath))
-                for f in filenames:
-                    solr_doc = os.path.join(dirpath, f)
-           
-                    doc = etree.parse(solr_doc)
-                    i.submit(etree.tostring(doc), solr_doc)
-
-
-                i.commit()
-                i.optimize()
-
-            if args.n is not None and count == int(args.n):
-                sys.exit()
+        crawler = Crawler(args.input, args.n, args.output, transforms, url_base, args.workers, args.engine,
+            manifest, words=WordCoordinates(args.words_format, args.words_gzip), stats=stats,
+            items_from=args.items_from, changes=args.changes, prune=args.prune,
+            tiles=args.tiles, shard=shard)
+        if args.pipeline:
+            # hand the page documents straight to the indexer
+            if args.stream_items:
+                crawler.item_sink = i.stream
+            else:
+                crawler.sink = i.add
+            crawler.write_stubs = not args.no_stubs
+
+        if args.watch:
+            watcher = Watcher(crawler, i, args.watch_interval, args.settle, args.watch_poll, stats=stats,
+                deep_interval=args.watch_deep_interval)
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+            try:
+                watcher.run()
+            except (KeyboardInterrupt, SystemExit):
+                log.info("No longer watching %s" % args.input)
+        else:
+            crawler.run()
+
+    if args.post is not None or args.pipeline:
+        # remove the items which have disappeared from the input
+        if (args.crawl is not None or args.pipeline) and manifest is not None:
+            for dirpath, group in crawler.disappeared:
+                log.info("Removing %s from the index" % group)
+                i.clean('group:"%s"' % group)
+                manifest.remove(dirpath, group)
+
+    if args.post is not None and not args.pipeline:
+        # the solr stubs are in the output folder when there is one
+        post_folder = args.output if args.output is not None else args.input
+        log.info("Posting the data in: %s" % post_folder)
+
+        ledger = None
+        if args.ledger is not None:
+            ledger = Ledger(args.ledger)
+
+        poster = Poster(i, args.readers, args.validate, ledger=ledger, full=args.full or args.rebuild,
+            stream=args.stream_items, stats=stats)
+        poster.run(post_folder, args.n)
+
+        if ledger is not None:
+            ledger.close()
+
+    if args.post is not None or args.pipeline:
+        # send whatever is left over and make it all visible
+        i.flush()
+        if commit_within is None:
+            i.commit()
+
+        if args.optimize or args.rebuild:
+            i.optimize()
+
+        if args.rebuild:
+            # only put the new index live if all of it made it in
+            if stats.counters.get('documents_failed', 0):
+                log.error("%s documents weren't indexed; not swapping %s with %s" %
+                    (stats.counters['documents_failed'], staging_core, live_core))
+            else:
+                i.swap(live_core)
+
+        i.close()
+
+    if manifest is not None:
+        manifest.close()
+
+    # how did we go?
+    stats.merge_profiles()
+    if args.stats is not None:
+        stats.write(args.stats)
+    log.info("Summary: %s" % json.dumps(stats.summary(), sort_keys=True))
@@ -1,5 +1,17 @@
 #!/bin/bash
 
-./process-udc-archive.py --config config/udc-config --input /srv/udc/UDS-Archives/libcat/ --output /srv/data/DCVW --crawl --post
-rsync -av /srv/data/DCVW/ 115.146.84.251:/srv/data/DCVW/
-rsync -av /srv/data/DCVW/ 115.146.86.212:/srv/data/DCVW/
\ No newline at end of file
+CHANGES=/srv/data/DCVW.changes
+
+DEAD_LETTER=/srv/data/DCVW.dead-letter
+
+# the pages solr didn't take are kept in the dead letter file; resubmit them
+#  with --replay $DEAD_LETTER once solr is healthy
+./process-udc-archive.py --config config/udc-config --input /srv/udc/UDS-Archives/libcat/ --output /srv/data/DCVW --crawl --post \
+    --manifest /srv/data/DCVW.manifest --prune --changes $CHANGES --dead-letter $DEAD_LETTER
+
+# only copy what the crawl changed; files listed but no longer there are deleted from the mirrors.
+#  the changes are kept (and added to by the next run) until both mirrors are up to date
+tools/replicate --changes $CHANGES --source /srv/data/DCVW --list > $CHANGES.list
+rsync -av --files-from=$CHANGES.list --delete-missing-args /srv/data/DCVW/ 115.146.84.251:/srv/data/DCVW/ && \
+rsync -av --files-from=$CHANGES.list --delete-missing-args /srv/data/DCVW/ 115.146.86.212:/srv/data/DCVW/ && \
+rm -f $CHANGES $CHANGES.list
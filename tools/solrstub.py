@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""A stand-in for Solr's update and core admin handlers
+
+Accepts update messages (plain or with chunked transfer encoding) on
+/solr/(core)/update and core admin requests on /solr/admin/cores, keeps count
+of what it was sent and can be told to fail requests. Useful for benchmarking
+and trying out the post stage without a real Solr.
+"""
+
+import argparse
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
+import urlparse
+
+class SolrStubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self):
+        """Read the request body, handling chunked transfer encoding"""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0].strip(), 16)
+                if size == 0:
+                    # skip any trailers
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            self.server.stub.chunked += 1
+            return ''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.read_body()
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        path = urlparse.urlparse(self.path).path
+        with stub.lock:
+            stub.requests += 1
+            stub.bytes += len(body)
+            if stub.fail > 0:
+                stub.fail -= 1
+                failed = True
+            else:
+                failed = False
+                core = path.split('/')[-2] if path.endswith('/update') else None
+                stub.record(core, body)
+
+        if failed:
+            self.respond(503, '<response><lst name="error"><str name="msg">Service Unavailable</str></lst></response>')
+        else:
+            self.respond(200, '<response><lst name="responseHeader"><int name="status">0</int></lst></response>')
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        with stub.lock:
+            stub.requests += 1
+            if url.path.endswith('/admin/cores'):
+                stub.admin.append(params)
+                if params.get('action', '').upper() == 'SWAP':
+                    core, other = params.get('core'), params.get('other')
+                    stub.cores[core], stub.cores[other] = stub.cores.get(other, 0), stub.cores.get(core, 0)
+        self.respond(200, '<response><lst name="responseHeader"><int name="status">0</int></lst></response>')
+
+    def log_message(self, format, *args):
+        pass
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class SolrStub:
+    """A stand-in Solr server running in a background thread"""
+    def __init__(self, port=0, latency=0, keep=False):
+        self.server = ThreadedHTTPServer(('127.0.0.1', port), SolrStubHandler)
+        self.server.stub = self
+        self.port = self.server.server_address[1]
+        self.latency = latency
+        self.keep = keep
+        self.lock = threading.Lock()
+
+        self.fail = 0
+        self.requests = 0
+        self.bytes = 0
+        self.documents = 0
+        self.chunked = 0
+        self.commits = 0
+        self.optimizes = 0
+        self.deletes = 0
+        self.messages = []
+        self.admin = []
+
+        # documents added to each core (commits aren't modelled)
+        self.cores = {}
+
+    def url(self, core='DCVW'):
+        return "http://127.0.0.1:%s/solr/%s" % (self.port, core)
+
+    def record(self, core, body):
+        """Keep count of what's in an update message"""
+        docs = body.count('<doc>') + body.count('<doc ')
+        self.documents += docs
+        self.cores[core] = self.cores.get(core, 0) + docs
+        if '<commit' in body:
+            self.commits += 1
+        if '<optimize' in body:
+            self.optimizes += 1
+        if '<delete' in body:
+            self.deletes += 1
+            if '<query>*:*</query>' in body:
+                self.cores[core] = 0
+        if self.keep:
+            self.messages.append((core, body))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={ 'poll_interval': 0.05 })
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='A stand-in Solr server')
+    parser.add_argument('--port', dest='port', type=int, default=8983, help='The port to listen on. Default: 8983')
+    parser.add_argument('--latency', dest='latency', type=float, default=0, help='Seconds to wait before answering each update.')
+    args = parser.parse_args()
+
+    stub = SolrStub(args.port, args.latency)
+    print "Listening on %s" % stub.url()
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print "%s requests, %s documents, %s commits" % (stub.requests, stub.documents, stub.commits)